@@ -0,0 +1,142 @@
+"""
+Batch OCR of archived screenshots.
+
+    python extract.py --batch SCREENSHOTS_DIR 'season*/race*.png' -o results.jsonl
+
+Inputs may be files, directories (searched recursively) or glob patterns.
+Images are OCRed across a process pool with the same preprocessing as the bot,
+and one JSON line is written per image as soon as it is done. With
+--group-by-dir, the images of each directory are merged into one race (in
+file name order, like a multi-screenshot message) and written as one line.
+Files or groups already present in the output file are skipped, so an
+interrupted run can be resumed with the same command.
+"""
+import argparse
+import glob
+import heapq
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from extract import extract_rankings_from_bytes, format_rankings
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def find_images(inputs: list[str]) -> list[str]:
+    """Expand files, directories and glob patterns into a sorted list of image paths."""
+    paths = set()
+    for item in inputs:
+        matches = glob.glob(item, recursive=True) if glob.has_magic(item) else [item]
+        for match in matches:
+            if os.path.isdir(match):
+                for root, _, files in os.walk(match):
+                    paths.update(os.path.join(root, f) for f in files if f.lower().endswith(IMAGE_EXTENSIONS))
+            elif match.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(match):
+                paths.add(match)
+    return sorted(paths)
+
+
+def ocr_file(path: str):
+    """
+    OCR one file in a worker process.
+    Returns (path, rankings, seconds, error message or None).
+    """
+    start = time.perf_counter()
+    try:
+        with open(path, 'rb') as f:
+            rankings = extract_rankings_from_bytes(f.read())
+        return path, rankings, time.perf_counter() - start, None
+    except Exception as e:
+        return path, {}, time.perf_counter() - start, f"{type(e).__name__}: {e}"
+
+
+def load_done(output: str | None) -> set[str]:
+    """Files and groups already recorded in the output file."""
+    done = set()
+    if not output or not os.path.exists(output):
+        return done
+    with open(output, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short by an interrupted run; that image is redone
+                continue
+            if record.get('error') is None:
+                done.add(record.get('group') or record.get('file'))
+    return done
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('inputs', nargs='+', help="image files, directories or glob patterns")
+    parser.add_argument('-o', '--output', help="JSON lines file to append to (default: stdout)")
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1, help="OCR worker processes")
+    parser.add_argument('--group-by-dir', action='store_true', help="merge the images of each directory into one race")
+    parser.add_argument('--slowest', type=int, default=5, help="number of slowest files in the summary")
+    args = parser.parse_args(argv)
+
+    paths = find_images(args.inputs)
+    done = load_done(args.output)
+    if args.group_by_dir:
+        groups = {}
+        for path in paths:
+            groups.setdefault(os.path.dirname(path), []).append(path)
+        groups = {group: files for group, files in groups.items() if group not in done}
+        todo = [path for files in groups.values() for path in files]
+    else:
+        todo = [path for path in paths if path not in done]
+    print(f"{len(paths)} images found, {len(paths) - len(todo)} already done, {len(todo)} to OCR",
+          file=sys.stderr)
+
+    out = open(args.output, 'a', encoding='utf-8') if args.output else sys.stdout
+    group_results = {}  # {group: {path: rankings}}
+    timings = []
+    errors = 0
+    start = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=max(1, args.workers)) as executor:
+            futures = [executor.submit(ocr_file, path) for path in todo]
+            for future in as_completed(futures):
+                path, rankings, seconds, error = future.result()
+                timings.append((seconds, path))
+                if error is not None:
+                    errors += 1
+                if not args.group_by_dir:
+                    record = {'file': path, 'ranking': format_rankings(rankings), 'seconds': round(seconds, 3)}
+                    if error is not None:
+                        record['error'] = error
+                    out.write(json.dumps(record, ensure_ascii=False) + '\n')
+                    out.flush()
+                    continue
+                group = os.path.dirname(path)
+                group_results.setdefault(group, {})[path] = (rankings, error)
+                if len(group_results[group]) == len(groups[group]):
+                    # Merge in file name order, as rankings_all.update does for a message
+                    merged = {}
+                    group_errors = [e for _, e in group_results[group].values() if e is not None]
+                    for file in groups[group]:
+                        merged.update(group_results[group][file][0])
+                    record = {'group': group, 'files': groups[group], 'ranking': format_rankings(merged)}
+                    if group_errors:
+                        record['error'] = '; '.join(group_errors)
+                    out.write(json.dumps(record, ensure_ascii=False) + '\n')
+                    out.flush()
+                    del group_results[group]
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    elapsed = time.perf_counter() - start
+    rate = len(timings) / elapsed if elapsed > 0 else 0.0
+    print(f"OCRed {len(timings)} images in {elapsed:.1f} s ({rate:.2f} images/s, {errors} errors)", file=sys.stderr)
+    for seconds, path in heapq.nlargest(args.slowest, timings):
+        print(f"  {seconds:6.2f} s  {path}", file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
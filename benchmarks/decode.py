@@ -0,0 +1,89 @@
+"""
+Compare screenshot preprocessing across upload resolutions and formats: the
+full decode it used to start with against decode_screenshot and
+locate_ranking_region (see extract.py). Each case runs in a fresh process,
+so its peak RSS can be reported next to the median time.
+
+    python benchmarks/decode.py [--repeat 3] [--rows 20]
+"""
+import argparse
+import io
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+from PIL import Image  # noqa: E402
+
+import extract  # noqa: E402
+from synthetic import screenshot  # noqa: E402
+
+RESOLUTIONS = [(1280, 720), (1920, 1080), (2560, 1440), (3840, 2160), (4000, 3000), (7680, 4320)]
+
+
+def legacy_crop_to_ranking_region(image_bytes):
+    """extract.crop_to_ranking_region before decode_screenshot: full decode, table search at full resolution."""
+    img = Image.open(io.BytesIO(image_bytes)).convert('L')
+    region = extract.find_ranking_region(np.asarray(img))
+    if region is not None:
+        box, line_height = region
+        img = img.crop(box)
+        if line_height > extract.TARGET_LINE_HEIGHT:
+            scale = extract.TARGET_LINE_HEIGHT / line_height
+            img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))),
+                             Image.Resampling.LANCZOS)
+    return img
+
+
+def peak_rss_kib() -> int:
+    """Peak RSS of this process. ru_maxrss is kept across fork and exec, so the kernel's VmHWM is preferred."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_case(name: str, image: bytes, repeat: int):
+    """In a fresh process: (median seconds, peak RSS growth in MiB, output size)."""
+    crop = legacy_crop_to_ranking_region if name == "legacy" else extract.crop_to_ranking_region
+    before = peak_rss_kib()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        size = crop(image).size
+        times.append(time.perf_counter() - start)
+    peak = peak_rss_kib()
+    return statistics.median(times), (peak - before) / 1024, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--rows", type=int, default=20)
+    args = parser.parse_args()
+    context = multiprocessing.get_context("spawn")
+
+    print(f"{'image':<16}{'legacy ms':>11}{'MiB':>7}{'new ms':>9}{'MiB':>7}  crop (legacy / new)")
+    for width, height in RESOLUTIONS:
+        for fmt in ("PNG", "JPEG"):
+            image = screenshot((width, height), args.rows, fmt=fmt)
+            results = []
+            for name in ("legacy", "new"):
+                with context.Pool(1) as pool:
+                    results.append(pool.apply(run_case, (name, image, args.repeat)))
+            (old_s, old_mb, old_size), (new_s, new_mb, new_size) = results
+            print(f"{width}x{height} {fmt:<5}{old_s * 1000:>10.1f}{old_mb:>7.0f}{new_s * 1000:>9.1f}{new_mb:>7.0f}"
+                  f"  {old_size[0]}x{old_size[1]} / {new_size[0]}x{new_size[1]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Compare the ranking parsers of parsing.py with the line-by-line regex
+parsers they replaced, on OCR texts and replies of growing size.
+
+    python benchmarks/parse.py [--texts 200] [--repeat 5]
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from extract import format_rankings  # noqa: E402
+from parsing import by_name, by_rank, parse_ocr_text, parse_ocr_texts, parse_reply  # noqa: E402
+from synthetic import ranking_text  # noqa: E402
+
+
+def legacy_parse_rankings_from_text(text):
+    """extract.parse_rankings_from_text before parsing.py: two patterns compiled per call, tried on every line."""
+    ranking_pattern_dash = re.compile(r'.*?(\d{1,2}|DSQ|DNF)\s*[-–—]\s*(.+).*')
+    ranking_pattern_dot = re.compile(r'.*?(\d{1,2})\.\s+(?:\S+\s+)?(.*?)(?=\s+\+|\s+DSQ|$)')
+    rankings = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        match = ranking_pattern_dash.search(line) or ranking_pattern_dot.search(line)
+        if match:
+            rank_str, username = match.group(1), match.group(2).strip()
+            try:
+                rankings[int(rank_str) if rank_str not in ('DSQ', 'DNF') else rank_str] = username
+            except ValueError:
+                rankings[rank_str] = username
+    return rankings
+
+
+def legacy_parse_ranking(message_content):
+    """main.parse_ranking before parsing.py: split and int() with exception handling per line."""
+    ranking = {}
+    for line in message_content.splitlines():
+        if line.startswith("Ranking:"):
+            continue
+        parts = line.strip().split(maxsplit=1)
+        if len(parts) < 2:
+            continue
+        try:
+            ranking[parts[1].strip()] = parts[0] if parts[0] in ('DSQ', 'DNF') else int(parts[0])
+        except ValueError:
+            continue
+    return ranking
+
+
+def bench(func, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--texts", type=int, default=200, help="OCR texts per batch")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'case':<36}{'legacy ms':>12}{'new ms':>10}{'speedup':>10}")
+    for rows in (20, 60, 99):
+        # One text per screenshot, 20-row screens of a season, or one long lobby
+        texts = [ranking_text(rows, "mixed", seed) for seed in range(args.texts)]
+        replies = ["Ranking:\n" + "\n".join(format_rankings(by_rank(parse_ocr_text(text)))) for text in texts]
+        cases = [
+            (f"ocr {args.texts} texts x {rows} rows",
+             lambda: [legacy_parse_rankings_from_text(text) for text in texts],
+             lambda: [by_rank(rows) for rows in parse_ocr_texts(texts)]),
+            (f"reply {args.texts} texts x {rows} rows",
+             lambda: [legacy_parse_ranking(reply) for reply in replies],
+             lambda: [by_name(parse_reply(reply)) for reply in replies]),
+        ]
+        for name, legacy, new in cases:
+            before, after = bench(legacy, args.repeat), bench(new, args.repeat)
+            print(f"{name:<36}{before * 1000:>12.1f}{after * 1000:>10.1f}{before / after:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""
+Benchmark every stage of the screenshot -> ranking -> race table pipeline
+on synthetic data, offline and without Discord.
+
+    python benchmarks/pipeline.py -o bench.json
+    python benchmarks/pipeline.py --compare bench.json --threshold 0.25
+
+Stages are timed separately (preprocessing, OCR, text parsing, scoring, table
+building and rendering) and end to end. Results are written as JSON. With
+--compare, median times are checked against a stored baseline and the exit
+status is 1 if any stage got slower than the threshold allows.
+OCR stages are skipped when no Tesseract backend is installed.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import extract  # noqa: E402
+from main import build_race_table, calculate_total, parse_ranking, render_table_image  # noqa: E402
+from render_pil import render_table_image_pil  # noqa: E402
+from rows import extract_rankings_from_rows, new_rows, segment_rows_from_bytes  # noqa: E402
+from synthetic import league, ranking_text, screenshot  # noqa: E402
+
+RESOLUTIONS = [(1280, 720), (1920, 1080), (2560, 1440), (2400, 1080)]
+ROW_COUNTS = [10, 20]
+LEAGUES = [(20, 5), (100, 20), (300, 40)]
+QUICK_RESOLUTIONS = [(1920, 1080)]
+QUICK_LEAGUES = [(20, 5), (100, 20)]
+
+
+def measure(func, repeat: int) -> dict:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {"best": min(times), "median": statistics.median(times), "repeat": repeat}
+
+
+def ocr_available() -> bool:
+    return extract.backend_name() == "tesserocr" or shutil.which("tesseract") is not None
+
+
+def run(repeat: int, quick: bool) -> dict:
+    results = {}
+    resolutions = QUICK_RESOLUTIONS if quick else RESOLUTIONS
+    leagues = QUICK_LEAGUES if quick else LEAGUES
+    has_ocr = ocr_available()
+    if not has_ocr:
+        print("Tesseract is not available, skipping OCR stages", file=sys.stderr)
+
+    def record(name, func, times=repeat):
+        results[name] = measure(func, times)
+        print(f"{name:<48}{results[name]['median'] * 1000:>10.2f} ms", file=sys.stderr)
+
+    for width, height in resolutions:
+        for rows in ROW_COUNTS:
+            for scripts in ("latin", "mixed"):
+                image = screenshot((width, height), rows, scripts)
+                tag = f"{width}x{height}/{rows}rows/{scripts}"
+                record(f"preprocess/{tag}", lambda: extract.preprocess_image_from_bytes(image))
+                if has_ocr:
+                    processed = extract.preprocess_image_from_bytes(image)
+                    record(f"ocr/{tag}", lambda: extract.get_backend().image_to_text(processed))
+                    record(f"end_to_end_ocr/{tag}", lambda: extract.extract_rankings_from_bytes(image))
+
+    # A long lobby posted as three screenshots overlapping by half their rows
+    upload = [screenshot(rows=12, first_rank=first, lobby=24) for first in (1, 7, 13)]
+    record("rows/segment_upload", lambda: [segment_rows_from_bytes(image) for image in upload])
+    if has_ocr:
+        record("ocr_upload/whole", lambda: [extract.extract_rankings_from_bytes(image) for image in upload])
+
+        def ocr_upload_rows():
+            for strips in new_rows([segment_rows_from_bytes(image)[0] for image in upload]):
+                extract_rankings_from_rows(strips)
+        record("ocr_upload/rows", ocr_upload_rows)
+
+    for rows in (20, 200):
+        text = ranking_text(rows, "mixed")
+        record(f"parse_rankings_from_text/{rows}rows", lambda: extract.parse_rankings_from_text(text), repeat * 10)
+        reply = "Ranking:\n" + "\n".join(extract.format_rankings(extract.parse_rankings_from_text(text)))
+        record(f"parse_ranking/{rows}rows", lambda: parse_ranking(reply), repeat * 10)
+
+    for participants, races in leagues:
+        all_races = league(participants, races)
+        tag = f"{participants}x{races}"
+        record(f"calculate_total/{tag}", lambda: calculate_total(all_races))
+        record(f"build_race_table/{tag}", lambda: build_race_table(all_races))
+        df = build_race_table(all_races)
+        record(f"render_pillow/{tag}", lambda: render_table_image_pil(df))
+        # matplotlib takes tens of seconds on large tables
+        if participants <= 20:
+            record(f"render_matplotlib/{tag}", lambda: render_table_image(df), max(1, repeat // 2))
+
+    # Reply text -> table, as on a race reaction (OCR excluded so it runs everywhere)
+    text = ranking_text(20, "mixed")
+    previous = league(20, 5)
+
+    def reaction_to_table():
+        reply = "Ranking:\n" + "\n".join(extract.format_rankings(extract.parse_rankings_from_text(text)))
+        all_races = dict(previous)
+        all_races[6] = parse_ranking(reply)
+        render_table_image_pil(build_race_table(all_races))
+    record("end_to_end/text_to_table", reaction_to_table)
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Stages whose median time grew by more than `threshold` (0.25 = 25%)."""
+    regressions = []
+    for name, current in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        ratio = current["median"] / before["median"] if before["median"] > 0 else 1.0
+        if ratio > 1 + threshold:
+            regressions.append(f"{name}: {before['median'] * 1000:.2f} ms -> {current['median'] * 1000:.2f} ms "
+                               f"({(ratio - 1) * 100:+.0f}%)")
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-o", "--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", metavar="BASELINE", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown before flagging (0.25 = 25%%)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--quick", action="store_true", help="fewer resolutions and league sizes")
+    args = parser.parse_args(argv)
+    # matplotlib warns about every glyph missing from its font
+    warnings.filterwarnings("ignore", category=UserWarning)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "ocr_backend": extract.backend_name() if ocr_available() else None,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": run(args.repeat, args.quick),
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(report["results"], baseline, args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            return 1
+        print(f"No regressions against {args.compare}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,46 @@
+"""
+Compare the matplotlib and Pillow race table renderers.
+
+    python benchmarks/render_table.py [--participants 40] [--races 10] [--repeat 5]
+"""
+import argparse
+import os
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import build_race_table, render_table_image  # noqa: E402
+from render_pil import render_table_image_pil  # noqa: E402
+from synthetic import league  # noqa: E402
+
+
+def bench(render, df, repeat: int):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        size = len(render(df).getvalue())
+        times.append(time.perf_counter() - start)
+    return min(times), sorted(times)[len(times) // 2], size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--participants", type=int, default=40)
+    parser.add_argument("--races", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    # matplotlib warns about every glyph missing from its font
+    warnings.filterwarnings("ignore", category=UserWarning)
+
+    df = build_race_table(league(args.participants, args.races))
+    print(f"{args.participants} participants x {args.races} races")
+    print(f"{'renderer':<12}{'best ms':>10}{'median ms':>12}{'PNG bytes':>12}")
+    for name, render in [("matplotlib", render_table_image), ("pillow", render_table_image_pil)]:
+        best, median, size = bench(render, df, args.repeat)
+        print(f"{name:<12}{best * 1000:>10.1f}{median * 1000:>12.1f}{size:>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Synthetic VRI-style data for the benchmarks: ranking screenshots and leagues.
+"""
+import io
+import random
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from render_pil import load_font
+
+LATIN = ["Guest_{}", "Sailor{}", "Cool Guy {}", "AnotherPlayer{}"]
+CYRILLIC = ["Чемпион{}", "Моряк_{}"]
+CJK = ["水手{}", "船乗り{}"]
+
+
+def participant_names(count: int, scripts: str = "latin", seed: int = 0) -> list[str]:
+    """
+    Generate distinct participant names. `scripts` is 'latin', 'cyrillic',
+    'cjk' or 'mixed'.
+    """
+    rng = random.Random(seed)
+    templates = {"latin": LATIN, "cyrillic": CYRILLIC, "cjk": CJK, "mixed": LATIN + CYRILLIC + CJK}[scripts]
+    names = []
+    for i in range(count):
+        template = rng.choice(templates)
+        names.append(template.format(1723161531080 + i if template.startswith("Guest") else i))
+    return names
+
+
+def ranking_rows(names: list[str], dsq: int = 1, dnf: int = 1) -> list[str]:
+    """
+    Rows as shown on the VRI results screen, in both formats: finishers as
+    "6. FR Name +00:15.2 29 pts", then "DSQ - Name" and "DNF - Name".
+    """
+    finishers = names[:len(names) - dsq - dnf]
+    rows = [f"{i}. FR {name} +00:{i:02d}.{i % 10} {30 - i} pts" for i, name in enumerate(finishers, start=1)]
+    rows += [f"DSQ - {name}" for name in names[len(finishers):len(finishers) + dsq]]
+    rows += [f"DNF - {name}" for name in names[len(finishers) + dsq:]]
+    return rows
+
+
+def ranking_text(rows: int, scripts: str = "latin", seed: int = 0) -> str:
+    """OCR-like text of a results screen, with some junk lines around it."""
+    names = participant_names(rows, scripts, seed)
+    return "\n".join(["RESULTS", ""] + ranking_rows(names) + ["", "Continue", "x 0.9 ~~"])
+
+
+def screenshot(size: tuple[int, int] = (1920, 1080), rows: int = 10, scripts: str = "latin",
+               seed: int = 0, fmt: str = "PNG", first_rank: int = 1, lobby: int | None = None) -> bytes:
+    """
+    A results screenshot: a busy "3D view" on the left and the results panel
+    with `rows` ranking rows on the right, scaled with the resolution. The
+    panel is scrolled to rows `first_rank`..`first_rank + rows - 1` of a
+    lobby of `lobby` participants (by default just the rows shown), as in
+    uploads of several overlapping screenshots.
+    """
+    width, height = size
+    rng = np.random.default_rng(seed + first_rank - 1)
+    img = Image.new("RGB", size, (20, 60, 110))
+    view = (rng.random((height // 2, width // 2, 3)) * 255).astype(np.uint8)
+    img.paste(Image.fromarray(view), (width // 40, height // 10))
+
+    font_size = max(10, height // (2 * rows + 6))
+    font = load_font(False, font_size)[0]
+    draw = ImageDraw.Draw(img)
+    left, top = width * 9 // 16, height // 10
+    draw.rectangle((left - font_size, top - font_size, width - width // 40, height - height // 20), fill=(15, 25, 40))
+    names = participant_names(lobby or first_rank + rows - 1, scripts, seed)
+    for i, row in enumerate(ranking_rows(names)[first_rank - 1:first_rank - 1 + rows]):
+        draw.text((left, top + i * font_size * 3 // 2), row, fill=(235, 235, 235), font=font)
+
+    buf = io.BytesIO()
+    img.save(buf, format=fmt)
+    return buf.getvalue()
+
+
+def league(participants: int, races: int, seed: int = 0, scripts: str = "mixed") -> dict:
+    """Random results {race: {name: position or DSQ/DNF}} of a league."""
+    rng = random.Random(seed)
+    names = participant_names(participants, scripts, seed)
+    all_races = {}
+    for race in range(1, races + 1):
+        starters = rng.sample(names, rng.randint(max(1, participants // 2), participants))
+        results = {name: pos for pos, name in enumerate(starters, start=1)}
+        for name in starters[-2:]:
+            results[name] = rng.choice(["DSQ", "DNF"])
+        all_races[race] = results
+    return all_races
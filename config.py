@@ -0,0 +1,94 @@
+import os
+
+# Bot settings, overridable through environment variables (e.g. in docker-compose.yml).
+
+def _int_env(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    if value is None or not value.strip():
+        return default
+    return int(value)
+
+def _float_env(name: str, default: float) -> float:
+    value = os.environ.get(name)
+    if value is None or not value.strip():
+        return default
+    return float(value)
+
+# --- OCR process pool ---
+# Number of worker processes running Tesseract (defaults to one per core)
+OCR_WORKERS = _int_env("VRI_OCR_WORKERS", os.cpu_count() or 1)
+# Number of queued OCR jobs (one job per message) before users are told the bot is busy
+OCR_MAX_QUEUE = _int_env("VRI_OCR_MAX_QUEUE", 8)
+# Hard limit of waiting OCR jobs; further screenshot messages are refused until the queue drains
+OCR_MAX_PENDING = _int_env("VRI_OCR_MAX_PENDING", 32)
+
+# OCR engine: 'tesserocr' (engine kept loaded in each worker), 'pytesseract'
+# (one tesseract process per image) or 'auto' (tesserocr when installed)
+OCR_BACKEND = os.environ.get("VRI_OCR_BACKEND", "auto")
+# Split multi-screenshot messages into rows and OCR rows repeated across screenshots only once
+OCR_DEDUPE_ROWS = _int_env("VRI_OCR_DEDUPE_ROWS", 1) != 0
+# Screenshots with more pixels than this (read from the image header) are not decoded
+OCR_MAX_PIXELS = _int_env("VRI_OCR_MAX_PIXELS", 40_000_000)
+
+# --- Remote OCR workers ---
+# Address the bot serves OCR jobs on, unix:/path or host:port; when set, OCR runs
+# in ocr_worker.py processes connecting to it instead of the bot's own process pool
+OCR_QUEUE = os.environ.get("VRI_OCR_QUEUE", "")
+# Shared secret workers must present to the queue
+OCR_QUEUE_TOKEN = os.environ.get("VRI_OCR_QUEUE_TOKEN", "")
+# Seconds a worker may take for one image before the job is given to another worker
+OCR_QUEUE_TIMEOUT = _float_env("VRI_OCR_QUEUE_TIMEOUT", 60.0)
+# Attempts per job before it fails
+OCR_QUEUE_ATTEMPTS = _int_env("VRI_OCR_QUEUE_ATTEMPTS", 3)
+# Seconds a job may wait for a worker to take it, e.g. while none is connected, before it fails
+OCR_QUEUE_WAIT = _float_env("VRI_OCR_QUEUE_WAIT", 120.0)
+
+# --- OCR result cache ---
+# Memory budget of the in-memory tier, in bytes of serialized rankings
+OCR_CACHE_MAX_BYTES = _int_env("VRI_OCR_CACHE_MAX_BYTES", 4 * 1024 * 1024)
+# Directory of the on-disk tier; leave empty to keep the cache in memory only
+OCR_CACHE_DIR = os.environ.get("VRI_OCR_CACHE_DIR", "")
+
+# --- Attachment downloads ---
+# Attachments larger than this are skipped (checked before and during the download)
+DOWNLOAD_MAX_BYTES = _int_env("VRI_DOWNLOAD_MAX_BYTES", 16 * 1024 * 1024)
+# Maximum simultaneous connections of the shared HTTP session
+DOWNLOAD_MAX_CONNECTIONS = _int_env("VRI_DOWNLOAD_MAX_CONNECTIONS", 16)
+# Total timeout of one download, in seconds
+DOWNLOAD_TIMEOUT = _int_env("VRI_DOWNLOAD_TIMEOUT", 30)
+
+# --- Race table rendering ---
+# 'matplotlib' or 'pillow' (faster, draws the same layout directly)
+TABLE_RENDERER = os.environ.get("VRI_TABLE_RENDERER", "matplotlib")
+# Font files for the pillow renderer; Noto Sans CJK is used when left empty
+TABLE_FONT = os.environ.get("VRI_TABLE_FONT", "")
+TABLE_FONT_BOLD = os.environ.get("VRI_TABLE_FONT_BOLD", "")
+# Seconds to wait for more race reactions before rebuilding a channel's table
+TABLE_DEBOUNCE_SECONDS = _float_env("VRI_TABLE_DEBOUNCE_SECONDS", 1.5)
+
+# --- Regatta state ---
+# SQLite database keeping races, name aliases and table message IDs across restarts
+STATE_DB = os.environ.get("VRI_STATE_DB", "data/vri_state.sqlite3")
+# Seconds between batched writes to the database
+STATE_FLUSH_SECONDS = _float_env("VRI_STATE_FLUSH_SECONDS", 1.0)
+# Channels unused for this many seconds are dropped from memory (reloaded on demand)
+STATE_IDLE_TTL = _float_env("VRI_STATE_IDLE_TTL", 6 * 3600)
+
+# --- Startup ---
+# After connecting, load the table renderer and the OCR workers in the background
+# so the first screenshot and the first table are not slowed down by it; 0 disables it
+WARMUP = _int_env("VRI_WARMUP", 1) != 0
+
+# --- Recovery from channel history ---
+# Rebuild the regattas of channels without stored races from their history after connecting
+RECOVER_ON_START = _int_env("VRI_RECOVER_ON_START", 0) != 0
+# Messages read back per channel, at most (the scan also stops at the last !reset)
+RECOVERY_HISTORY_LIMIT = _int_env("VRI_RECOVERY_HISTORY_LIMIT", 1000)
+# Channels whose history is read at the same time
+RECOVERY_CONCURRENCY = _int_env("VRI_RECOVERY_CONCURRENCY", 4)
+
+# --- Metrics ---
+# Local port serving Prometheus metrics at /metrics; 0 disables it
+METRICS_PORT = _int_env("VRI_METRICS_PORT", 0)
+# Seconds between metric summaries in the log; 0 disables them
+METRICS_LOG_INTERVAL = _float_env("VRI_METRICS_LOG_INTERVAL", 0)
@@ -0,0 +1,60 @@
+import asyncio
+import logging
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import aiohttp
+
+CHUNK_SIZE = 64 * 1024
+
+
+def create_session(max_connections: int, timeout: float) -> 'aiohttp.ClientSession':
+    """
+    Create the long-lived HTTP session used for all attachment downloads,
+    so connections to the Discord CDN are pooled and reused.
+    """
+    import aiohttp
+    connector = aiohttp.TCPConnector(limit=max_connections, ttl_dns_cache=300)
+    return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout))
+
+
+async def download_attachment(session: 'aiohttp.ClientSession', attachment, max_bytes: int) -> bytes | None:
+    """
+    Download one attachment, or return None if it failed or is larger than max_bytes.
+    The size reported by Discord is checked first, and the streaming read stops
+    as soon as the cap is exceeded.
+    """
+    if attachment.size and attachment.size > max_bytes:
+        logging.info(f"Skipping attachment {attachment.filename}: {attachment.size} bytes exceeds {max_bytes}")
+        return None
+    async with session.get(attachment.url) as resp:
+        if resp.status != 200:
+            logging.warning(f"Failed to download attachment {attachment.filename}: HTTP {resp.status}")
+            return None
+        chunks = []
+        total = 0
+        async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+            total += len(chunk)
+            if total > max_bytes:
+                logging.info(f"Aborted download of {attachment.filename}: more than {max_bytes} bytes")
+                return None
+            chunks.append(chunk)
+    return b"".join(chunks)
+
+
+async def download_attachments(session: 'aiohttp.ClientSession', attachments, max_bytes: int) -> list[bytes]:
+    """
+    Download attachments concurrently. Returns the contents of the successful
+    downloads in the original attachment order.
+    """
+    results = await asyncio.gather(
+        *(download_attachment(session, a, max_bytes) for a in attachments),
+        return_exceptions=True,
+    )
+    images = []
+    for attachment, result in zip(attachments, results):
+        if isinstance(result, BaseException):
+            logging.error(f"Failed to download attachment {attachment.filename}: {result!r}")
+        elif result is not None:
+            images.append(result)
+    return images
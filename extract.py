@@ -1,111 +1,421 @@
+import importlib.util
 import io
-import re
+import math
+import string
 import sys
+import time
 
-import pytesseract
+import numpy as np
 from PIL import Image, ImageFilter
 
-def extract_rank_username(match_obj):
+import config
+from languages import resolve as resolve_language
+from parsing import PARSER_VERSION, by_rank, parse_ocr_text, parse_ocr_texts
+
+# Grayscale level below which a pixel is considered text
+THRESHOLD = 160
+# Page segmentation mode: the cropped table is a single uniform block of text
+TESSERACT_PSM = 6
+# Characters expected in ranking rows: ranks, DSQ/DNF, Latin names, times and points
+RANKING_WHITELIST = string.digits + string.ascii_letters + "._-–—+:()[]#&!?"
+# Added for Russian names; with Japanese there are too many characters to list, so nothing is whitelisted
+CYRILLIC_LETTERS = "АБВГДЕЁЖЗИЙКЛМНОПРСТУФХЦЧШЩЪЫЬЭЮЯабвгдеёжзийклмнопрстуфхцчшщъыьэюя"
+# Extra flags passed to Tesseract by the pytesseract backend
+TESSERACT_CONFIG = f'--psm {TESSERACT_PSM} -c tessedit_char_whitelist={RANKING_WHITELIST} -c preserve_interword_spaces=1'
+# Height in pixels that text lines are scaled down to before OCR
+TARGET_LINE_HEIGHT = 32
+# Larger screenshots are reduced by an integer factor, to no less than this many
+# pixels (1080p), for decoding JPEGs and for locating the results table
+DECODE_PIXELS = 1920 * 1080
+# CJK-like glyphs a text line needs to count as Japanese (see cjk_score)
+CJK_GLYPHS = 2
+# Lookup table for thresholding, applied by Pillow in C instead of a per-pixel lambda
+THRESHOLD_LUT = [0] * THRESHOLD + [255] * (256 - THRESHOLD)
+
+def ocr_settings_key() -> str:
     """
-    Given a regex match object, extract the rank and username.
-    Rank is converted to an int if it's numeric, otherwise kept as a string.
+    Describe the preprocessing and OCR settings. Cached OCR results are only
+    reused when this string matches, so change it whenever the output may change.
     """
-    rank_str = match_obj.group(1)
-    username = match_obj.group(2).strip()
-    try:
-        if rank_str not in ('DSQ', 'DNF'):
-            return int(rank_str), username
-    except ValueError:
-        pass
-    return rank_str, username
+    return (f"threshold={THRESHOLD};tesseract={TESSERACT_CONFIG};line_height={TARGET_LINE_HEIGHT};"
+            f"backend={backend_name()};parser={PARSER_VERSION};decode={DECODE_PIXELS}")
 
-def parse_rankings_from_text(text):
+def char_whitelist(lang: str) -> str | None:
+    """
+    Characters Tesseract may output for a language string like 'eng+rus', or None for any.
     """
-    Parse text to extract rankings.
-    Two patterns:
-      1)  {number} - {name}
-      2)  {number}. {flag} {name} {time/points}
+    langs = lang.split('+')
+    if 'jpn' in langs:
+        return None
+    if 'rus' in langs:
+        return RANKING_WHITELIST + CYRILLIC_LETTERS
+    return RANKING_WHITELIST
 
-    We only keep the rank and the name, ignoring flags, times, or points.
+def tesseract_config(lang: str) -> str:
     """
+    Flags passed to Tesseract by the pytesseract backend for a language string.
+    """
+    whitelist = char_whitelist(lang)
+    if whitelist == RANKING_WHITELIST:
+        return TESSERACT_CONFIG
+    config = f'--psm {TESSERACT_PSM} -c preserve_interword_spaces=1'
+    return config if whitelist is None else f'{config} -c tessedit_char_whitelist={whitelist}'
 
-    # Pattern 1: "6 - Guest_1723161531080" or "DSQ - Guest_1723161531080" or "DNF - Guest_1723161531080"
-    # ranking_pattern_dash = re.compile(r'(\d{1,2})\s*[-–—]\s*(.+)')
-    ranking_pattern_dash = re.compile(r'.*?(\d{1,2}|DSQ|DNF)\s*[-–—]\s*(.+).*')
+class OcrBackend:
+    """
+    Turns a preprocessed PIL image into text.
+    """
+    name = ''
 
-    # Pattern 2: "6. 🇫🇷 Guest_1723161531080 +00:15.2 29 pts" (or DSQ, etc.)
-    # Explanation:
-    #   (\d{1,2})\.\s+     => Captures rank and skips the dot
-    #   (?:\S+\s+)?         => Optionally skip a single "flag" token (e.g., country code or emoji)
-    #   (.*?)(?=\s+\+|\s+DSQ|$)
-    #       - Capture the name (including spaces) until we see:
-    #         - a space + plus sign (time)  OR
-    #         - a space + DSQ              OR
-    #         - end of string
-    ranking_pattern_dot = re.compile(r'.*?(\d{1,2})\.\s+(?:\S+\s+)?(.*?)(?=\s+\+|\s+DSQ|$)')
+    def image_to_text(self, image, lang='eng') -> str:
+        raise NotImplementedError
 
-    rankings = {}
-    for line in text.splitlines():
-        line = line.strip()
-        if not line:
-            continue
+class PytesseractBackend(OcrBackend):
+    """
+    Runs the tesseract binary through pytesseract. Simple and always available,
+    but every call writes a temp file and starts a process that reloads the models.
+    """
+    name = 'pytesseract'
 
-        match = ranking_pattern_dash.search(line)
-        if match:
-            rank, username = extract_rank_username(match)
-            rankings[rank] = username
-            continue
+    def image_to_text(self, image, lang='eng') -> str:
+        import pytesseract
+        return pytesseract.image_to_string(image, lang=lang, config=tesseract_config(lang))
 
-        match = ranking_pattern_dot.search(line)
-        if match:
-            rank, username = extract_rank_username(match)
-            rankings[rank] = username
-            continue
+class TesserocrBackend(OcrBackend):
+    """
+    Keeps the Tesseract engine loaded in this process through tesserocr and
+    passes images in memory. One engine is kept per language set.
+    """
+    name = 'tesserocr'
+
+    def __init__(self):
+        import tesserocr  # optional dependency
+        self._tesserocr = tesserocr
+        self._apis = {}
+
+    def _api(self, lang):
+        api = self._apis.get(lang)
+        if api is None:
+            api = self._tesserocr.PyTessBaseAPI(lang=lang, psm=TESSERACT_PSM)
+            whitelist = char_whitelist(lang)
+            if whitelist is not None:
+                api.SetVariable('tessedit_char_whitelist', whitelist)
+            api.SetVariable('preserve_interword_spaces', '1')
+            self._apis[lang] = api
+        return api
+
+    def image_to_text(self, image, lang='eng') -> str:
+        api = self._api(lang)
+        api.SetImage(image.convert('L'))
+        return api.GetUTF8Text()
 
-        # If neither pattern matches, ignore the line or debug-print:
-        # print("No match:", line)
+_backend = None
 
-    return rankings
+def backend_name() -> str:
+    """
+    Name of the backend get_backend() uses, without loading it.
+    """
+    if config.OCR_BACKEND == 'auto':
+        return 'tesserocr' if importlib.util.find_spec('tesserocr') else 'pytesseract'
+    return config.OCR_BACKEND
+
+def get_backend() -> OcrBackend:
+    """
+    Return this process's OCR backend, created on first use so each worker
+    process gets its own engine. config.OCR_BACKEND selects 'tesserocr',
+    'pytesseract' or 'auto' (tesserocr if installed, pytesseract otherwise).
+    """
+    global _backend
+    if _backend is None:
+        if backend_name() == 'tesserocr':
+            _backend = TesserocrBackend()
+        else:
+            _backend = PytesseractBackend()
+    return _backend
+
+def warm_up(lang='eng') -> str:
+    """
+    Load the OCR backend of this process and run it once on a blank image, so
+    the first real screenshot does not pay for loading the engine and models.
+    Returns the backend name; failures are left to the first real OCR call.
+    """
+    backend = get_backend()
+    try:
+        backend.image_to_text(Image.new('L', (64, TARGET_LINE_HEIGHT), 255), lang=lang)
+    except Exception:
+        pass
+    return backend.name
+
+def parse_rankings_from_text(text):
+    """
+    Parse OCR text into {rank: name}, with 'DSQ'/'DNF'/'DNS' as the rank of
+    non-finishers. Rows look like "6. FR Name +00:15.2 29 pts" or
+    "DSQ - Name"; flags, times and points are dropped (see parsing.py).
+    """
+    return by_rank(parse_ocr_text(text))
 
 def extract_rankings_from_image(image):
     """
-    Extract rankings from a PIL image.
+    Extract rankings from a PIL screenshot, cropped to the results table and
+    binarized first, since the backends' page segmentation expects one block
+    of rows (see preprocess_image_from_bytes).
     """
-    text = pytesseract.image_to_string(image)
+    text = get_backend().image_to_text(binarize(crop_image_to_ranking_region(image.convert('L'))))
     return parse_rankings_from_text(text)
 
 def extract_rankings_from_bytes(image_bytes):
     """
     Preprocess the image bytes and extract rankings.
     """
-    image = preprocess_image_from_bytes(image_bytes)
-    return extract_rankings_from_image(image)
+    text = get_backend().image_to_text(preprocess_image_from_bytes(image_bytes))
+    return parse_rankings_from_text(text)
+
+def find_text_lines(gray: np.ndarray) -> list[tuple[int, int]]:
+    """
+    Find horizontal bands of text in a grayscale image.
+    Rows crossing text have many dark/light transitions after thresholding,
+    whatever the text polarity, while flat UI areas have none.
+    Returns a list of (top, bottom) row ranges, bottom exclusive.
+    """
+    binary = gray >= THRESHOLD
+    transitions = np.count_nonzero(binary[:, 1:] != binary[:, :-1], axis=1)
+    is_text = transitions >= max(4, gray.shape[1] // 200)
+    # Start and end rows of the runs of text rows
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], is_text.astype(np.int8), [0]))))
+    lines = []
+    for top, bottom in zip(edges[::2].tolist(), edges[1::2].tolist()):
+        # Reattach descenders separated from their line by a thin gap
+        if lines and top - lines[-1][1] <= 3:
+            lines[-1] = (lines[-1][0], bottom)
+        else:
+            lines.append((top, bottom))
+    return [(top, bottom) for top, bottom in lines if bottom - top >= 4]
 
-def preprocess_image_from_bytes(image_bytes):
+def cjk_score(gray: np.ndarray) -> float:
+    """
+    Share of the text lines in a grayscale crop of the table with at least
+    CJK_GLYPHS glyphs that look like CJK characters: glyphs are split at blank
+    columns, and CJK ones are about as wide as the line is high and cross at
+    least five strokes along some row or column. Simple kana are missed, so
+    Japanese names written only in them go unnoticed.
+    """
+    lines = find_text_lines(gray)
+    cjk_lines = 0
+    for top, bottom in lines:
+        line = gray[top:bottom] >= THRESHOLD
+        # Text is whatever differs from the dominant (background) level of the line
+        ink = line != (np.count_nonzero(line) * 2 > line.size)
+        has_ink = ink.any(axis=0)
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], has_ink.astype(np.int8), [0]))))
+        height = bottom - top
+        cjk = 0
+        for left, right in zip(edges[::2].tolist(), edges[1::2].tolist()):
+            width = right - left
+            if not 0.6 * height <= width <= 1.3 * height:
+                continue
+            glyph = ink[:, left:right].astype(np.int8)
+            # Strokes crossed by the busiest row and column: at most 4 for Latin and
+            # Cyrillic letters (m, W, Ж), more for most kanji
+            row_strokes = np.count_nonzero(np.diff(glyph, axis=1, prepend=0) == 1, axis=1).max()
+            column_strokes = np.count_nonzero(np.diff(glyph, axis=0, prepend=0) == 1, axis=0).max()
+            if max(row_strokes, column_strokes) >= 5:
+                cjk += 1
+        # A lone match is more likely merged letters (e.g. "mm") than a Japanese name
+        cjk_lines += cjk >= CJK_GLYPHS
+    return cjk_lines / len(lines) if lines else 0.0
+
+def _largest_line_block(lines: list[tuple[int, int]]):
+    """
+    Group text lines separated by less than two line heights into blocks and
+    return the block with most lines, ignoring bands too tall to be text
+    (busy parts of the 3D view). Returns None if no block has two lines.
+    """
+    if not lines:
+        return None
+    line_height = float(np.median([bottom - top for top, bottom in lines]))
+    lines = [line for line in lines if line[1] - line[0] <= 3 * line_height]
+    blocks = []
+    for line in lines:
+        if blocks and line[0] - blocks[-1][-1][1] <= 2 * line_height:
+            blocks[-1].append(line)
+        else:
+            blocks.append([line])
+    block = max(blocks, key=len, default=[])
+    return block if len(block) >= 2 else None
+
+def find_ranking_region(gray: np.ndarray):
     """
-    Preprocess image bytes to improve OCR accuracy.
+    Locate the results table in a grayscale screenshot.
+    The table is the largest block of evenly spaced text lines; its horizontal
+    extent comes from the column transition profile of that block. Lines are
+    then searched again within those columns only, to recover table rows that
+    share their height with other busy parts of the screen.
+    Returns ((left, top, right, bottom), median line height), or None if no
+    table-like block is found.
     """
-    img = Image.open(io.BytesIO(image_bytes)).convert('L')  # Convert to grayscale
-    # Simple thresholding; adjust the threshold as needed
-    img = img.point(lambda x: 0 if x < 160 else 255, '1')
+    block = _largest_line_block(find_text_lines(gray))
+    if block is None:
+        return None
+    top, bottom = block[0][0], block[-1][1]
+
+    binary = gray[top:bottom] >= THRESHOLD
+    columns = np.count_nonzero(binary[1:] != binary[:-1], axis=0)
+    text_columns = np.flatnonzero(columns)
+    if text_columns.size == 0:
+        return None
+    left, right = int(text_columns[0]), int(text_columns[-1]) + 1
+
+    refined = _largest_line_block(find_text_lines(gray[:, left:right]))
+    if refined is not None and refined[0][0] <= top and refined[-1][1] >= bottom:
+        block = refined
+        top, bottom = block[0][0], block[-1][1]
+    line_height = float(np.median([b - t for t, b in block]))
+
+    # Rows of the refined block may be wider than those the columns came from:
+    # extend over text columns less than a line height away
+    binary = gray[top:bottom] >= THRESHOLD
+    is_text = np.count_nonzero(binary[1:] != binary[:-1], axis=0) > 0
+    gap = int(line_height)
+    while left > 0 and is_text[max(0, left - gap):left].any():
+        left = max(0, left - gap) + int(np.flatnonzero(is_text[max(0, left - gap):left])[0])
+    while right < is_text.size and is_text[right:right + gap].any():
+        right = right + int(np.flatnonzero(is_text[right:right + gap])[-1]) + 1
+
+    pad = int(line_height // 2)
+    height, width = gray.shape
+    box = (max(0, left - pad), max(0, top - pad), min(width, right + pad), min(height, bottom + pad))
+    return box, line_height
+
+def extract_rankings_from_bytes_timed(image_bytes, lang_hint: str | None = None):
+    """
+    Like extract_rankings_from_bytes, but also returns the seconds spent in
+    each stage: (rankings, {"preprocess": s, "tesseract": s, "parse": s}).
+    With a channel's `lang_hint` (see languages.py), the Tesseract models are
+    chosen for this image; without, English is used.
+    """
+    start = time.perf_counter()
+    cropped = crop_to_ranking_region(image_bytes)
+    lang = 'eng' if lang_hint is None else resolve_language(lang_hint, cjk_score(np.asarray(cropped)))
+    image = binarize(cropped)
+    preprocessed = time.perf_counter()
+    text = get_backend().image_to_text(image, lang=lang)
+    recognized = time.perf_counter()
+    rankings = parse_rankings_from_text(text)
+    timings = {
+        "preprocess": preprocessed - start,
+        "tesseract": recognized - preprocessed,
+        "parse": time.perf_counter() - recognized,
+    }
+    return rankings, timings
+
+class ImageTooLarge(ValueError):
+    """A screenshot has more pixels than config.OCR_MAX_PIXELS."""
+
+
+def open_screenshot(image_bytes):
+    """
+    Open a screenshot without decoding it: only the header is read. Raises
+    ImageTooLarge above config.OCR_MAX_PIXELS, and PIL.UnidentifiedImageError
+    for data that is not an image. Pillow's own decompression bomb check
+    fails images far above it in Image.open already, so that is reported as
+    ImageTooLarge too.
+    """
+    try:
+        img = Image.open(io.BytesIO(image_bytes))
+    except Image.DecompressionBombError as e:
+        raise ImageTooLarge(str(e)) from e
+    if img.width * img.height > config.OCR_MAX_PIXELS:
+        raise ImageTooLarge(f"{img.width}x{img.height} image exceeds {config.OCR_MAX_PIXELS} pixels")
+    return img
+
+def _reduction(img) -> int:
+    """Largest integer factor that keeps at least DECODE_PIXELS pixels of an image."""
+    return max(1, int(math.sqrt(img.width * img.height / DECODE_PIXELS)))
+
+def decode_screenshot(image_bytes):
+    """
+    Decode a screenshot to grayscale. Large JPEGs (phone photos, 4K) are
+    decoded at reduced scale by libjpeg in draft mode, to no less than
+    DECODE_PIXELS pixels; other formats are decoded whole, since PNG cannot
+    be decoded at reduced scale, and locate_ranking_region keeps the work
+    on them small.
+    """
+    img = open_screenshot(image_bytes)
+    factor = _reduction(img)
+    if factor > 1 and img.format == 'JPEG':
+        # Scales by 1/2, 1/4 or 1/8 to no less than the requested size
+        img.draft('L', (-(-img.width // factor), -(-img.height // factor)))
+    return img.convert('L')
+
+def locate_ranking_region(img):
+    """
+    find_ranking_region on a grayscale image, coarse to fine above
+    DECODE_PIXELS: the table is first searched on a box-reduced copy of about
+    1080p, then again at full resolution within that box and a margin of a
+    few lines, which gives the exact box and line height. Returns the same as
+    find_ranking_region.
+    """
+    factor = _reduction(img)
+    if factor == 1:
+        return find_ranking_region(np.asarray(img))
+    coarse = find_ranking_region(np.asarray(img.reduce(factor)))
+    if coarse is None:
+        return None
+    (left, top, right, bottom), line_height = coarse
+    margin = int(2 * line_height)
+    area = (max(0, (left - margin) * factor), max(0, (top - margin) * factor),
+            min(img.width, (right + margin) * factor), min(img.height, (bottom + margin) * factor))
+    fine = find_ranking_region(np.asarray(img.crop(area)))
+    if fine is None:
+        return (area, line_height * factor)
+    (left, top, right, bottom), line_height = fine
+    return (left + area[0], top + area[1], right + area[0], bottom + area[1]), line_height
+
+def crop_to_ranking_region(image_bytes):
+    """
+    Decode a screenshot to grayscale, crop it to the results table and scale
+    it down so text lines are about TARGET_LINE_HEIGHT pixels high before
+    thresholding: Tesseract time grows
+    with the pixel count, and the 3D view and overlays only produce junk
+    lines. The whole image is kept if no table is found.
+    """
+    return crop_image_to_ranking_region(decode_screenshot(image_bytes))
+
+def crop_image_to_ranking_region(img):
+    """crop_to_ranking_region of a screenshot already decoded to grayscale."""
+    region = locate_ranking_region(img)
+    if region is not None:
+        box, line_height = region
+        img = img.crop(box)
+        if line_height > TARGET_LINE_HEIGHT:
+            scale = TARGET_LINE_HEIGHT / line_height
+            size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+            img = img.resize(size, Image.Resampling.LANCZOS)
+    return img
+
+def binarize(img):
+    """
+    Threshold and sharpen a grayscale image for Tesseract.
+    """
+    img = img.point(THRESHOLD_LUT, '1')
     img = img.filter(ImageFilter.SHARPEN)
     return img
 
-def extract_rankings(image_paths: list[str]) -> list:
+def preprocess_image_from_bytes(image_bytes):
     """
-    Extract rankings from a list of image file paths.
-    Useful for command-line usage.
+    Preprocess image bytes to improve OCR accuracy: crop_to_ranking_region,
+    then binarize.
     """
-    combined_rankings = {}
-    for image_path in image_paths:
-        img = Image.open(image_path)
-        text = pytesseract.image_to_string(img)
-        extracted = parse_rankings_from_text(text)
-        combined_rankings.update(extracted)
+    return binarize(crop_to_ranking_region(image_bytes))
 
+def format_rankings(rankings: dict) -> list[str]:
+    """
+    Format rankings as "rank name" lines: ranks 1..max in order, with "???" for
+    missing ranks, followed by DSQ/DNF sorted alphabetically.
+    """
     # Separate integer and string keys
-    int_ranks = {k: v for k, v in combined_rankings.items() if isinstance(k, int)}
-    str_ranks = {k: v for k, v in combined_rankings.items() if isinstance(k, str)}
+    int_ranks = {k: v for k, v in rankings.items() if isinstance(k, int)}
+    str_ranks = {k: v for k, v in rankings.items() if isinstance(k, str)}
 
     result_lines = []
     if int_ranks:
@@ -121,7 +431,25 @@ def extract_rankings(image_paths: list[str]) -> list:
 
     return result_lines
 
+def extract_rankings(image_paths: list[str]) -> list:
+    """
+    Extract rankings from a list of image file paths, preprocessed like the
+    bot's screenshots. Useful for command-line usage.
+    """
+    texts = []
+    for image_path in image_paths:
+        with open(image_path, 'rb') as f:
+            texts.append(get_backend().image_to_text(preprocess_image_from_bytes(f.read())))
+    combined_rankings = {}
+    for rows in parse_ocr_texts(texts):
+        combined_rankings.update(by_rank(rows))
+    return format_rankings(combined_rankings)
+
 if __name__ == "__main__":
+    if "--batch" in sys.argv[1:]:
+        # Parallel, streaming OCR of many files; see batch.py
+        from batch import main
+        sys.exit(main([arg for arg in sys.argv[1:] if arg != "--batch"]))
     image_paths = sys.argv[1:]
     ordered_list = extract_rankings(image_paths)
     print("\n".join(ordered_list))
@@ -0,0 +1,116 @@
+"""
+Choice of Tesseract language models per image.
+
+Running every image with all installed models (eng+rus+jpn) is several times
+slower than one model, so the models are picked per image from two cheap
+signals:
+
+* a pixel-level detector on the cropped table (extract.cjk_score): most CJK
+  glyphs are about as wide as the text line is high and cross more strokes
+  than any Latin or Cyrillic letter. It tells whether Japanese is needed,
+  but cannot tell Cyrillic from Latin;
+* the channel's LanguageProfile: the scripts of the names recognized in the
+  channel so far. Once established, it gives the models the channel needs.
+
+The bot passes the channel's hint to the OCR workers, which resolve it with
+the detector. Until a channel is established, and whenever the detector is
+unsure, all models are used together.
+"""
+import unicodedata
+
+# Tesseract model of each script
+SCRIPT_LANGUAGES = {"latin": "eng", "cyrillic": "rus", "cjk": "jpn"}
+ALL_LANGUAGES = "eng+rus+jpn"
+# Hint for channels whose language mix is not known yet
+AUTO = "auto"
+
+# Share of text lines with CJK-like glyphs from which Japanese is surely
+# needed, and up to which it is not
+CJK_SURE = 0.1
+CJK_NONE = 0.0
+# A channel is established after this many recognized letters
+MIN_LETTERS = 40
+# A script needs this share of the recognized letters for its model to be used
+MIN_SHARE = 0.05
+# Every this many images, an established channel is OCRed as AUTO again, so a
+# script it has not used so far (and its models would not read) gets noticed
+EXPLORE_EVERY = 10
+
+
+def char_script(ch: str) -> str | None:
+    """'latin', 'cyrillic', 'cjk' or None for a character."""
+    if not ch.isalpha():
+        return None
+    name = unicodedata.name(ch, "")
+    if name.startswith("LATIN"):
+        return "latin"
+    if name.startswith("CYRILLIC"):
+        return "cyrillic"
+    if name.startswith(("CJK", "HIRAGANA", "KATAKANA", "HALFWIDTH KATAKANA")):
+        return "cjk"
+    return None
+
+
+class LanguageProfile:
+    """
+    Letters per script of the names recognized in one channel.
+    """
+
+    def __init__(self, names=()):
+        self.letters = dict.fromkeys(SCRIPT_LANGUAGES, 0)
+        self.images = 0
+        self.observe(names)
+
+    def observe(self, names):
+        for name in names:
+            for ch in name:
+                script = char_script(ch)
+                if script is not None:
+                    self.letters[script] += 1
+
+    def hint(self) -> str:
+        """
+        Models for the channel, e.g. 'eng' or 'eng+rus', or AUTO while fewer
+        than MIN_LETTERS letters were seen. eng is always included for the
+        ranks, times and Latin names.
+        """
+        total = sum(self.letters.values())
+        if total < MIN_LETTERS:
+            return AUTO
+        langs = ["eng"] + [SCRIPT_LANGUAGES[script] for script in ("cyrillic", "cjk")
+                           if self.letters[script] >= MIN_SHARE * total]
+        return "+".join(langs)
+
+    def next_hint(self) -> str:
+        """hint() for the next image to OCR, or AUTO every EXPLORE_EVERY images."""
+        self.images += 1
+        return AUTO if self.images % EXPLORE_EVERY == 0 else self.hint()
+
+
+def _models(hint: str | None, score: float) -> set[str]:
+    return {"eng"} if hint is None else set(resolve(hint, score).split("+"))
+
+
+def covers(used_hint: str | None, hint: str | None) -> bool:
+    """
+    Whether an image OCRed with `used_hint` was read with every model `hint`
+    would pick for it, whatever the detector found: resolve is checked on
+    each side of CJK_NONE and CJK_SURE. None stands for English only.
+    """
+    scores = (CJK_NONE, (CJK_NONE + CJK_SURE) / 2, CJK_SURE)
+    return all(_models(hint, score) <= _models(used_hint, score) for score in scores)
+
+
+def resolve(hint: str, score: float) -> str:
+    """
+    Tesseract language string for one image, from the channel's hint and the
+    share of text lines with CJK-like glyphs found by the detector.
+    """
+    if hint == AUTO:
+        # Cyrillic cannot be ruled out from pixels: only Japanese can be left out
+        return "eng+rus" if score <= CJK_NONE else ALL_LANGUAGES
+    langs = hint.split("+")
+    if "jpn" not in langs and score > CJK_NONE:
+        # Japanese names in a channel that had none: all models if unsure
+        return hint + "+jpn" if score >= CJK_SURE else ALL_LANGUAGES
+    return hint
@@ -1,20 +1,56 @@
-import aiohttp
-import discord
-import pandas as pd
-import matplotlib.pyplot as plt
+import time
+# Measured from here to on_ready and to the first posted table
+STARTED = time.perf_counter()
+
+import asyncio
+import threading
 from io import BytesIO
+from typing import TYPE_CHECKING
 
 import logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s:%(message)s', datefmt='%Y-%m-%d %H:%M:%S')
-from extract import extract_rankings_from_bytes
-from rapidfuzz.distance import Levenshtein # Import Levenshtein distance function
-
-intents = discord.Intents.default()
-intents.message_content = True
-
-client = discord.Client(intents=intents)
+import config
+import metrics
+from downloads import create_session, download_attachments
+from extract import ImageTooLarge, format_rankings, open_screenshot
+from languages import AUTO
+from ocr_cache import OcrCache
+from ocr_pool import OcrPool, OcrQueueFull
+from ocr_queue import OcrQueue
+from parsing import by_name, parse_reply
+from publish import TablePublisher
+from recovery import recover_channels, scan_history
+from render_pil import render_table_image_pil
+from scheduler import TableUpdateScheduler
+from scoring import ScoringEngine
+from store import ChannelState, RegattaStore
+
+# discord, pandas and matplotlib are imported where first needed, so importing
+# this module (e.g. from tests.py) stays fast; see warm_up() for the bot.
+if TYPE_CHECKING:
+    import pandas as pd
+
+# The bot's discord.Client, created by create_client()
+client = None
+ocr_cache = OcrCache(max_bytes=config.OCR_CACHE_MAX_BYTES, directory=config.OCR_CACHE_DIR)
+# With VRI_OCR_QUEUE, OCR is done by ocr_worker.py processes instead of a local process pool
+ocr_queue = OcrQueue(config.OCR_QUEUE, config.OCR_QUEUE_TOKEN, config.OCR_QUEUE_TIMEOUT,
+                     config.OCR_QUEUE_ATTEMPTS, config.OCR_QUEUE_WAIT) if config.OCR_QUEUE else None
+ocr_pool = OcrPool(workers=config.OCR_WORKERS, max_queue=config.OCR_MAX_QUEUE, max_pending=config.OCR_MAX_PENDING,
+                   cache=ocr_cache, dedupe_rows=config.OCR_DEDUPE_ROWS, executor=ocr_queue)
+# Serializes matplotlib/Pillow rendering between the event loop and warm_up()'s thread
+render_lock = threading.Lock()
+first_table_posted = False
+# discord.py fires on_ready again after every gateway reconnect; startup work runs once
+startup_done = False
+
+if config.METRICS_PORT or config.METRICS_LOG_INTERVAL:
+    metrics.enable()
+metrics.register_gauge("vri_ocr_queue_depth", "OCR jobs waiting for a worker.", lambda: ocr_pool.pending)
+metrics.register_gauge("vri_ocr_jobs_in_flight", "OCR jobs being processed.", lambda: ocr_pool.running)
+if ocr_queue is not None:
+    metrics.register_gauge("vri_ocr_workers_connected", "Connections of remote OCR workers.", lambda: ocr_queue.workers)
 
-@client.event
 async def on_message(message):
     # Ignore messages from bots
     if message.author.bot:
@@ -25,58 +61,67 @@ async def on_message(message):
             await message.reply("Reset command only works in a guild.")
             return
         channel_key = (message.guild.id, message.channel.id)
-        # Reset data structures
-        guild_race_tables[channel_key] = pd.DataFrame(columns=["Name", "Total"])
-        guild_race_tables[channel_key].index = guild_race_tables[channel_key].index + 1
-        guild_all_races[channel_key] = {}
-        # Also clear the reference to the last message ID for this channel,
-        # so the *next* table generated doesn't delete the one left behind by reset.
-        if channel_key in guild_latest_table_message_id:
-            del guild_latest_table_message_id[channel_key]
-            logging.info(f"Cleared last table message reference for channel {channel_key} after reset.")
+        async with table_scheduler.lock(channel_key):
+            # Race reactions not applied yet belong to the regatta being reset
+            table_scheduler.discard(channel_key)
+            table_publisher.discard(channel_key)
+            state = await regatta_store.channel(channel_key)
+            # Reset the races (learned OCR aliases stay useful for the next regatta) and
+            # also clear the reference to the last message ID for this channel,
+            # so the *next* table generated doesn't overwrite the one left behind by reset.
+            regatta_store.reset(state)
 
         logging.info(f"Race table reset for channel: {message.guild.name} #{message.channel.name}")
         await message.reply("Race table has been reset for this channel. The previous table message will remain.")
         return
 
+    if message.content.strip() == "!recover":
+        if message.guild is None:
+            await message.reply("Recover command only works in a guild.")
+            return
+        races = await recover_channel(message.channel, replace=True)
+        await message.reply(f"Recovered {races} races from the channel history." if races
+                            else "No labelled rankings found since the last reset.")
+        return
+
     # If the message has attachments
     if message.attachments:
-        images = []
-        for attachment in message.attachments:
-            if any(attachment.filename.lower().endswith(ext) for ext in ['.png', '.jpg', '.jpeg']):
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(attachment.url) as resp:
-                        if resp.status == 200:
-                            images.append(await resp.read())
+        screenshots = [a for a in message.attachments
+                       if any(a.filename.lower().endswith(ext) for ext in ['.png', '.jpg', '.jpeg'])]
+        guild_id = message.guild.id if message.guild else None
+        with metrics.timed("download", guild_id):
+            images = await download_attachments(client.http_session, screenshots, config.DOWNLOAD_MAX_BYTES)
+        images = [image for image in images if screenshot_accepted(image, guild_id)]
 
         if images:
+            metrics.inc("screenshots", guild_id, len(images))
+            # OCR languages follow the scripts of the names seen in this channel (see languages.py)
+            state = await regatta_store.channel((guild_id, message.channel.id)) if message.guild else None
+            lang_hint = state.languages.next_hint() if state else AUTO
+            try:
+                job = await ocr_pool.submit(guild_id, images, lang_hint)
+            except OcrQueueFull as e:
+                logging.warning(f"Refused screenshots of message {message.id}: {e}")
+                await message.reply("busy, try again later")
+                return
+            if job.position > ocr_pool.max_queue:
+                await message.reply(f"busy, queued at position {job.position}")
+            # Screenshots are OCRed in parallel; results come back in upload order
             rankings_all = {}
-            for img_bytes in images:
-                ranking = extract_rankings_from_bytes(img_bytes)
+            for ranking in await job:
                 rankings_all.update(ranking)
+            if state is not None:
+                state.languages.observe(rankings_all.values())
 
             if rankings_all:
-                # --- Start: Fill gaps with "???" ---
-                int_ranks = {k: v for k, v in rankings_all.items() if isinstance(k, int)}
-                str_ranks = {k: v for k, v in rankings_all.items() if isinstance(k, str)}
-
-                result_lines = []
-                if int_ranks:
-                    max_rank = max(int_ranks.keys())
-                    # Ensure all ranks from 1 to max_rank are present
-                    for i in range(1, max_rank + 1):
-                        username = int_ranks.get(i, "???") # Use "???" if rank is missing
-                        result_lines.append(f"{i} {username}")
-
-                # Append string ranks (DSQ, DNF) sorted alphabetically
-                for rank in sorted(str_ranks.keys()):
-                    result_lines.append(f"{rank} {str_ranks[rank]}")
-
-                result = "\n".join(result_lines)
-                # --- End: Fill gaps with "???" ---
-
-                await message.reply(f"Ranking:\n{result}")
+                # Fill gaps with "???"
+                result = "\n".join(format_rankings(rankings_all))
+
+                with metrics.timed("reply", guild_id):
+                    await message.reply(f"Ranking:\n{result}")
+                metrics.inc("rankings_posted", guild_id)
             else:
+                metrics.inc("no_rankings", guild_id)
                 logging.info(f"No rankings detected in attachments for message {message.id}")
                 # Optionally reply if no rankings found, currently silent
                 # await message.reply("No rankings detected in the image(s).")
@@ -97,10 +142,9 @@ emoji_to_int = {
     "🔟": 10,
 }
 
-guild_race_tables = {}
-guild_all_races = {}
-# Stores {channel_key: latest_bot_table_message_id}
-guild_latest_table_message_id = {}
+# Races, name aliases and the latest table message of each channel, persisted in SQLite
+regatta_store = RegattaStore(config.STATE_DB, idle_ttl=config.STATE_IDLE_TTL,
+                             flush_interval=config.STATE_FLUSH_SECONDS)
 
 def parse_ranking(message_content: str) -> dict:
     """
@@ -109,29 +153,23 @@ def parse_ranking(message_content: str) -> dict:
       1 SomePlayer
       2 AnotherPlayer
       3 Cool Guy
-      ...
+      DSQ Bad Sport
+    Lines that are not ranking rows, such as the header, are ignored.
     """
-    lines = message_content.splitlines()
-    ranking = {}
-    for line in lines:
-        if line.startswith("Ranking:"):
-            continue
-        line = line.strip()
-        if not line:
-            continue
-        parts = line.split(maxsplit=1)
-        if len(parts) < 2:
-            continue
-        try:
-            if parts[0] in ('DSQ', 'DNF'):
-                pos = parts[0]
-            else:
-                pos = int(parts[0])
-            participant = parts[1].strip()
-            ranking[participant] = pos
-        except ValueError:
-            continue
-    return ranking
+    return by_name(parse_reply(message_content))
+
+def screenshot_accepted(image_bytes: bytes, guild_id) -> bool:
+    """
+    Check a downloaded attachment from its header alone, before it is queued
+    for OCR: images above VRI_OCR_MAX_PIXELS and non-images are skipped.
+    """
+    try:
+        open_screenshot(image_bytes)
+        return True
+    except (ImageTooLarge, OSError) as e:
+        metrics.inc("screenshots_rejected", guild_id)
+        logging.info(f"Skipping attachment: {e}")
+        return False
 
 def calculate_total(all_races: dict) -> dict:
     """
@@ -140,32 +178,19 @@ def calculate_total(all_races: dict) -> dict:
     substitute DNS with (number of participants across all races + 1) and sum across races.
     DSQ and DNF are equal ti the number of actual finishers in a race + 1.
     """
-    # Determine the full set of participants across all races
-    all_participants = set()
-    for race in all_races.values():
-        all_participants.update(race.keys())
-    dns = len(all_participants) + 1
-    totals = {}
-    for participant in all_participants:
-        total = 0
-        for race in all_races.values():
-            dsq = len([v for v in race.values() if isinstance(v, int)]) + 1
-            result = race.get(participant, dns)
-            if isinstance(result, int):
-                total += result
-            elif isinstance(result, str) and result in ('DSQ', 'DNF'):
-                total += dsq
-        totals[participant] = total
-    return totals
-
-def build_race_table(all_races: dict) -> pd.DataFrame:
+    return ScoringEngine.from_races(all_races).totals()
+
+def build_race_table(all_races: dict, totals: dict | None = None) -> 'pd.DataFrame':
     """
     Build a race table DataFrame from all_races and calculated totals.
     The DataFrame has the first column "Name" (ordered by total score ascending),
     followed by race columns (sorted numerically), and the last column "Total".
     If a participant did not take part in a race, the cell contains "DNS".
+    Pass `totals` when they are already known (e.g. from a channel's ScoringEngine).
     """
-    totals = calculate_total(all_races)
+    import pandas as pd
+    if totals is None:
+        totals = calculate_total(all_races)
     # Order participants by ascending total score
     participants = sorted(totals.keys(), key=lambda p: totals[p])
     # Sort race columns numerically
@@ -181,10 +206,11 @@ def build_race_table(all_races: dict) -> pd.DataFrame:
     return pd.DataFrame(rows)
 
 
-def render_table_image(df: pd.DataFrame) -> BytesIO:
+def render_table_image(df: 'pd.DataFrame') -> BytesIO:
     """
     Render a pandas DataFrame as a PNG image with minimized whitespace.
     """
+    import matplotlib.pyplot as plt
     # Set font family to support Chinese and Japanese characters
     plt.rcParams['font.family'] = 'Noto Sans CJK JP'
     df_copy = df.copy()
@@ -238,7 +264,114 @@ def render_table_image(df: pd.DataFrame) -> BytesIO:
     return buf
 
 
-@client.event
+def render_race_table(df: 'pd.DataFrame') -> BytesIO:
+    """
+    Render the race table with the renderer selected by config.TABLE_RENDERER.
+    """
+    with render_lock:
+        if config.TABLE_RENDERER == "pillow":
+            return render_table_image_pil(df)
+        return render_table_image(df)
+
+
+def match_race_names(state: ChannelState, new_race_raw: dict, race_number) -> dict:
+    """
+    Replace OCR'd names with close names already seen in this channel's races.
+    """
+    max_distance = 2 # Max Levenshtein distance to consider a match
+    matches = state.names.match(new_race_raw.keys(), max_distance)
+
+    processed_race = {} # Store results for this race after matching
+    for raw_name, rank in new_race_raw.items():
+        final_name, distance = matches[raw_name]
+        if raw_name != final_name: # Log only if a change occurred
+            logging.info(f"Fuzzy matched new name '{raw_name}' to existing '{final_name}' (distance: {distance}) for race {race_number}")
+            if state.names.confirm(raw_name, final_name, race_number):
+                regatta_store.add_alias(state, raw_name, final_name)
+        processed_race[final_name] = rank
+    return processed_race
+
+
+async def update_race_table(channel_key, updates: dict, message):
+    """
+    Apply a batch of race updates {race_number: parsed ranking} to a channel,
+    then render the race table once and queue it on table_publisher. Called
+    by table_scheduler with the channel lock held.
+    """
+    guild_id = channel_key[0]
+    state = await regatta_store.channel(channel_key)
+    for race_number, new_race_raw in updates.items():
+        with metrics.timed("fuzzy_match", guild_id):
+            processed_race = match_race_names(state, new_race_raw, race_number)
+        # Store the processed race data (with potentially corrected names);
+        # only the column of this race is rescored
+        with metrics.timed("scoring", guild_id):
+            regatta_store.set_race(state, race_number, processed_race)
+
+    # Build the race table from all stored races (including the newly processed ones)
+    with metrics.timed("build_table", guild_id):
+        race_table = build_race_table(state.races, state.scoring.totals())
+    state.race_table = race_table
+
+    logging.info(f"Updated race table for channel: {message.guild.name} #{message.channel.name} ({channel_key})")
+    logging.info(f"Race table:\n{race_table}")
+    with metrics.timed("render", guild_id):
+        buf = render_race_table(race_table)
+
+    # Sent in the background; the previous table message is edited in place
+    table_publisher.publish(channel_key, buf.getvalue(), message, state.table_message_id)
+
+
+async def store_table_message(channel_key, message_id: int):
+    """
+    Remember the table message sent by table_publisher, so the next table edits it.
+    """
+    global first_table_posted
+    async with table_scheduler.lock(channel_key):
+        state = await regatta_store.channel(channel_key)
+        regatta_store.set_table_message(state, message_id)
+    if not first_table_posted:
+        first_table_posted = True
+        elapsed = time.perf_counter() - STARTED
+        metrics.observe("time_to_first_table", elapsed)
+        logging.info(f"First race table posted {elapsed:.2f}s after start")
+
+
+# Updates superseded while a table is being sent are dropped
+table_publisher = TablePublisher(on_published=store_table_message)
+
+# Reactions arriving within the debounce window produce a single table update
+table_scheduler = TableUpdateScheduler(update_race_table, debounce=config.TABLE_DEBOUNCE_SECONDS)
+
+
+async def recover_channel(channel, replace: bool = False) -> int:
+    """
+    Rebuild a channel's regatta from its history (see recovery.py) and post
+    one table for it. Channels that already have races are left alone unless
+    `replace` is set. Returns the number of recovered races.
+    """
+    channel_key = (channel.guild.id, channel.id)
+    # Checked before paging any history, so a restart costs one query per channel with races
+    if not replace and await regatta_store.has_races(channel_key):
+        return 0
+    found = await scan_history(channel, client.user.id, emoji_to_int, parse_ranking, config.RECOVERY_HISTORY_LIMIT)
+    logging.info(f"Scanned {found.scanned} messages of channel {channel_key}, found races {sorted(found.races)}")
+    if not found.races:
+        return 0
+    async with table_scheduler.lock(channel_key):
+        state = await regatta_store.channel(channel_key)
+        if state.races and not replace:
+            return 0
+        table_scheduler.discard(channel_key)
+        table_publisher.discard(channel_key)
+        table_message_id = state.table_message_id or found.table_message_id
+        regatta_store.reset(state)
+        regatta_store.set_table_message(state, table_message_id)
+        # Names go through the same fuzzy matching as live reactions, oldest race first
+        await update_race_table(channel_key, found.races, found.message)
+    return len(found.races)
+
+
 async def on_reaction_add(reaction, user):
     race_number = emoji_to_int.get(reaction.emoji)
     if race_number is None:
@@ -253,80 +386,7 @@ async def on_reaction_add(reaction, user):
         new_race_raw = parse_ranking(reaction.message.content)
 
         if new_race_raw:
-            # Ensure the channel data structure exists
-            if channel_key not in guild_all_races:
-                guild_all_races[channel_key] = {}
-
-            # --- Fuzzy Name Matching Logic ---
-            max_distance = 2 # Max Levenshtein distance to consider a match
-            processed_race = {} # Store results for this race after matching
-
-            # Get all unique names from previous races in this channel
-            existing_names = set()
-            for race_data in guild_all_races.get(channel_key, {}).values():
-                existing_names.update(race_data.keys())
-
-            logging.debug(f"Existing names for fuzzy matching: {existing_names}")
-
-            for raw_name, rank in new_race_raw.items():
-                final_name = raw_name # Default to the name as parsed
-                best_match_distance = max_distance + 1 # Initialize distance beyond threshold
-
-                # Find the closest existing name within the threshold
-                matched_existing_name = None
-                for existing_name in existing_names:
-                    distance = Levenshtein.distance(raw_name, existing_name)
-                    if distance <= max_distance and distance < best_match_distance:
-                        best_match_distance = distance
-                        matched_existing_name = existing_name
-                        # Optimization: If distance is 0 (exact match), no need to check further
-                        if distance == 0:
-                            break
-
-                if matched_existing_name:
-                    final_name = matched_existing_name # Use the matched existing name
-                    if raw_name != final_name: # Log only if a change occurred
-                        logging.info(f"Fuzzy matched new name '{raw_name}' to existing '{final_name}' (distance: {best_match_distance}) for race {race_number}")
-
-                processed_race[final_name] = rank
-            # --- End Fuzzy Name Matching Logic ---
-
-            # Store the processed race data (with potentially corrected names)
-            guild_all_races[channel_key][race_number] = processed_race
-
-            # Build the race table from all stored races (including the newly processed one)
-            race_table = build_race_table(guild_all_races[channel_key])
-            guild_race_tables[channel_key] = race_table
-
-            guild_race_tables[channel_key] = race_table
-
-            logging.info(f"Updated race table for channel: {reaction.message.guild.name} #{reaction.message.channel.name} ({channel_key})")
-            logging.info(f"Race table:\n{race_table}")
-            buf = render_table_image(race_table)
-
-            # Attempt to delete the previous table message before sending a new one
-            if channel_key in guild_latest_table_message_id:
-                try:
-                    old_message_id = guild_latest_table_message_id[channel_key]
-                    # Fetch the message object using the channel from the reaction's message
-                    old_message = await reaction.message.channel.fetch_message(old_message_id)
-                    await old_message.delete()
-                    logging.info(f"Deleted previous race table message {old_message_id} for channel {channel_key}")
-                except discord.NotFound:
-                    logging.warning(f"Previous race table message {old_message_id} not found for channel {channel_key}, might have been deleted already.")
-                except discord.Forbidden:
-                    logging.error(f"Bot lacks permissions to delete message {old_message_id} in channel {channel_key}.")
-                except Exception as e:
-                    logging.error(f"Failed to delete previous race table message {old_message_id}: {e}")
-                # Ensure the ID is removed from tracking even if deletion failed, to prevent repeated attempts
-                del guild_latest_table_message_id[channel_key]
-
-
-            # Send the new table message
-            sent_message = await reaction.message.reply(file=discord.File(buf, filename="race_table.png"))
-            # Store the ID of the newly sent message
-            guild_latest_table_message_id[channel_key] = sent_message.id
-            logging.info(f"Posted new race table message {sent_message.id} for channel {channel_key}")
+            table_scheduler.schedule(channel_key, race_number, new_race_raw, reaction.message)
         else:
             logging.info("No rankings detected in message.")
     else:
@@ -335,8 +395,84 @@ async def on_reaction_add(reaction, user):
 # Removed on_message_edit handler as it's incompatible with the single-table approach.
 # Users must re-react to edited messages to update the table.
 
+async def on_ready():
+    global startup_done
+    if startup_done:
+        logging.info(f"Reconnected as {client.user}")
+        return
+    startup_done = True
+    elapsed = time.perf_counter() - STARTED
+    metrics.observe("time_to_ready", elapsed)
+    logging.info(f"Logged in as {client.user}, ready {elapsed:.2f}s after start")
+    if config.WARMUP:
+        client.loop.create_task(warm_up())
+    if config.RECOVER_ON_START:
+        channels = [channel for guild in client.guilds for channel in guild.text_channels
+                    if channel.permissions_for(guild.me).read_message_history]
+        client.loop.create_task(recover_channels(channels, recover_channel, config.RECOVERY_CONCURRENCY))
+
+
+async def warm_up():
+    """
+    Load what the first requests would otherwise wait for, in the background:
+    the table renderer with its fonts, and the OCR worker processes with their engine.
+    """
+    start = time.perf_counter()
+    import pandas as pd
+    sample = pd.DataFrame({"Name": ["Some Player", "Чемпион", "水手"], "1": [1, 2, "DNS"], "Total": [1, 2, 4]})
+    # Renders a sample table so matplotlib builds its font cache (the slow part) off the event loop
+    await asyncio.to_thread(render_race_table, sample)
+    await ocr_pool.warm_up()
+    logging.info(f"Warm-up finished in {time.perf_counter() - start:.2f}s")
+
+
+def create_client():
+    """
+    Create the Discord client and register the event handlers above.
+    """
+    import discord
+
+    class VriClient(discord.Client):
+        """
+        Discord client owning the HTTP session shared by all attachment downloads
+        and the lifetime of the regatta state store.
+        """
+        http_session = None
+        _metrics_runner = None
+
+        async def setup_hook(self):
+            if ocr_queue is not None:
+                await ocr_queue.start()
+            self.http_session = create_session(config.DOWNLOAD_MAX_CONNECTIONS, config.DOWNLOAD_TIMEOUT)
+            self._eviction_task = self.loop.create_task(regatta_store.run_eviction())
+            if config.METRICS_PORT:
+                self._metrics_runner = await metrics.serve(config.METRICS_PORT)
+            if config.METRICS_LOG_INTERVAL:
+                self._metrics_log_task = self.loop.create_task(metrics.log_summary(config.METRICS_LOG_INTERVAL))
+
+        async def close(self):
+            if self.http_session is not None:
+                await self.http_session.close()
+            if self._metrics_runner is not None:
+                await self._metrics_runner.cleanup()
+            # Write the last regatta changes before exiting
+            await regatta_store.close()
+            await super().close()
+
+    intents = discord.Intents.default()
+    intents.message_content = True
+    new_client = VriClient(intents=intents)
+    for handler in (on_ready, on_message, on_reaction_add):
+        new_client.event(handler)
+    return new_client
+
+
 if __name__ == '__main__':
     with open("token.txt", "r") as f:
         token = f.read().strip()
 
-    client.run(token)
+    client = create_client()
+    try:
+        client.run(token)
+    finally:
+        ocr_pool.close()
@@ -0,0 +1,163 @@
+"""
+Per-stage latency and throughput metrics of the bot.
+
+Everything is a no-op until enable() is called, so instrumented code costs a
+flag check when metrics are off. When on, durations are kept as histograms by
+stage, guild and outcome, events as counters and queue sizes as gauges. They
+can be served in Prometheus text format on a local port and/or summarized in
+the log periodically.
+"""
+import asyncio
+import logging
+import time
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+enabled = False
+_histograms = {}  # {(stage, guild, outcome): [bucket counts..., sum, count, max]}
+_counters = {}  # {(event, guild): count}
+_gauges = {}  # {name: (help, callable returning the current value)}
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def observe(stage: str, seconds: float, guild=None, outcome: str = "ok"):
+    """Record the duration of one run of a stage."""
+    if not enabled:
+        return
+    key = (stage, "" if guild is None else str(guild), outcome)
+    values = _histograms.get(key)
+    if values is None:
+        values = _histograms[key] = [0] * len(BUCKETS) + [0.0, 0, 0.0]
+    for i, bound in enumerate(BUCKETS):
+        if seconds <= bound:
+            values[i] += 1
+            break
+    values[-3] += seconds
+    values[-2] += 1
+    values[-1] = max(values[-1], seconds)
+
+
+def inc(event: str, guild=None, amount: int = 1):
+    """Count an event."""
+    if not enabled:
+        return
+    key = (event, "" if guild is None else str(guild))
+    _counters[key] = _counters.get(key, 0) + amount
+
+
+def register_gauge(name: str, help_text: str, func):
+    """Report func() as gauge `name` when metrics are read."""
+    _gauges[name] = (help_text, func)
+
+
+class _Timer:
+    __slots__ = ("stage", "guild", "start")
+
+    def __init__(self, stage, guild):
+        self.stage = stage
+        self.guild = guild
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe(self.stage, time.perf_counter() - self.start, self.guild, "ok" if exc_type is None else "error")
+        return False
+
+
+class _NoTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NO_TIMER = _NoTimer()
+
+
+def timed(stage: str, guild=None):
+    """
+    Context manager timing a stage; the outcome is "error" if it raises.
+
+        with metrics.timed("render", guild_id):
+            ...
+    """
+    return _Timer(stage, guild) if enabled else _NO_TIMER
+
+
+def _labels(**labels) -> str:
+    parts = []
+    for name, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{name}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def render_prometheus() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    lines = [
+        "# HELP vri_stage_seconds Duration of pipeline stages.",
+        "# TYPE vri_stage_seconds histogram",
+    ]
+    for (stage, guild, outcome), values in sorted(_histograms.items()):
+        cumulative = 0
+        for bound, count in zip(BUCKETS, values):
+            cumulative += count
+            lines.append(f"vri_stage_seconds_bucket{_labels(stage=stage, guild=guild, outcome=outcome, le=bound)} {cumulative}")
+        lines.append(f"vri_stage_seconds_bucket{_labels(stage=stage, guild=guild, outcome=outcome, le='+Inf')} {values[-2]}")
+        lines.append(f"vri_stage_seconds_sum{_labels(stage=stage, guild=guild, outcome=outcome)} {values[-3]}")
+        lines.append(f"vri_stage_seconds_count{_labels(stage=stage, guild=guild, outcome=outcome)} {values[-2]}")
+    lines += ["# HELP vri_events_total Counted events.", "# TYPE vri_events_total counter"]
+    for (event, guild), count in sorted(_counters.items()):
+        lines.append(f"vri_events_total{_labels(event=event, guild=guild)} {count}")
+    for name, (help_text, func) in sorted(_gauges.items()):
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {func()}"]
+    return "\n".join(lines) + "\n"
+
+
+def summary() -> str:
+    """One line per stage (all guilds together): count, mean and max duration."""
+    stages = {}
+    for (stage, _, outcome), values in _histograms.items():
+        total = stages.setdefault(stage, [0.0, 0, 0.0, 0])
+        total[0] += values[-3]
+        total[1] += values[-2]
+        total[2] = max(total[2], values[-1])
+        if outcome != "ok":
+            total[3] += values[-2]
+    lines = [f"{stage}: n={count} mean={total_s / count * 1000:.1f}ms max={max_s * 1000:.1f}ms errors={errors}"
+             for stage, (total_s, count, max_s, errors) in sorted(stages.items()) if count]
+    lines += [f"{name}={func()}" for name, (_, func) in sorted(_gauges.items())]
+    return "; ".join(lines)
+
+
+async def serve(port: int, host: str = "127.0.0.1"):
+    """Serve /metrics on a local port. Returns the aiohttp runner (call cleanup() to stop)."""
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(text=render_prometheus(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return runner
+
+
+async def log_summary(interval: float):
+    """Background task logging summary() every `interval` seconds."""
+    while True:
+        await asyncio.sleep(interval)
+        logging.info(f"Metrics: {summary()}")
@@ -0,0 +1,118 @@
+import logging
+
+import numpy as np
+from rapidfuzz import process
+from rapidfuzz.distance import Levenshtein
+
+# A fuzzy match becomes a stored alias once it was made in this many races, so
+# one wrong merge of two real players is not kept for every later regatta
+ALIAS_CONFIRMATIONS = 2
+
+
+class NameIndex:
+    """
+    Participant names of one channel's regatta, for matching OCR'd names.
+
+    New names are matched all at once with rapidfuzz's `process.cdist`
+    against the known names, after a length prefilter (names whose lengths
+    differ by more than the allowed distance can never match). Known names are
+    counted per stored race, so a name that no race has any more (a replaced
+    race) stops attracting matches. Once the same OCR variant has been matched
+    to a known name in ALIAS_CONFIRMATIONS different races, the mapping is
+    kept in `aliases` and later resolved with a dict lookup.
+    """
+
+    def __init__(self, names=(), aliases: dict | None = None):
+        self.names = []  # known names, in the order they were first seen
+        self._known = {}  # {known name: number of races with it}
+        self._lengths = []
+        self.aliases = dict(aliases or {})  # {OCR variant: known name}
+        self._sightings = {}  # {(OCR variant, known name): {race numbers matched in}}, until confirmed
+        self.add(names)
+
+    def add(self, names):
+        """Add the names of a stored race to the index."""
+        for name in names:
+            count = self._known.get(name, 0)
+            if count == 0:
+                self.names.append(name)
+                self._lengths.append(len(name))
+            self._known[name] = count + 1
+
+    def remove(self, names):
+        """Remove the names of a stored race that is replaced; names left in no race are forgotten."""
+        for name in names:
+            count = self._known.get(name, 0)
+            if count > 1:
+                self._known[name] = count - 1
+            elif count == 1:
+                del self._known[name]
+                i = self.names.index(name)
+                del self.names[i]
+                del self._lengths[i]
+
+    def clear(self):
+        """Forget the names of the regatta; aliases are kept."""
+        self.names = []
+        self._known = {}
+        self._lengths = []
+
+    def match(self, raw_names, max_distance: int = 2) -> dict:
+        """
+        Map each raw name to (known name, Levenshtein distance), or to
+        (raw name, None) when no known name is within max_distance.
+        """
+        result = {}
+        unresolved = []
+        for raw_name in raw_names:
+            if raw_name in self._known:
+                result[raw_name] = (raw_name, 0)
+            elif raw_name in self.aliases:
+                result[raw_name] = (self.aliases[raw_name], Levenshtein.distance(raw_name, self.aliases[raw_name]))
+            else:
+                unresolved.append(raw_name)
+        if not unresolved or not self.names:
+            result.update({raw_name: (raw_name, None) for raw_name in unresolved})
+            return result
+
+        lengths = np.array(self._lengths)
+        query_lengths = [len(name) for name in unresolved]
+        candidates = np.flatnonzero((lengths >= min(query_lengths) - max_distance) &
+                                    (lengths <= max(query_lengths) + max_distance))
+        if candidates.size == 0:
+            result.update({raw_name: (raw_name, None) for raw_name in unresolved})
+            return result
+        choices = [self.names[i] for i in candidates]
+        # Distances above score_cutoff are reported as score_cutoff + 1
+        distances = process.cdist(unresolved, choices, scorer=Levenshtein.distance,
+                                  score_cutoff=max_distance, dtype=np.int32)
+        best = distances.argmin(axis=1)
+        for i, raw_name in enumerate(unresolved):
+            distance = int(distances[i, best[i]])
+            if distance <= max_distance:
+                result[raw_name] = (choices[best[i]], distance)
+            else:
+                result[raw_name] = (raw_name, None)
+        return result
+
+    def confirm(self, raw_name: str, name: str, race_number) -> bool:
+        """
+        Record a fuzzy match of raw_name to name made for a race. Returns True
+        once it was made for ALIAS_CONFIRMATIONS different races and should be
+        learned as an alias; the same race reacted to again, or replayed by
+        !recover, counts once.
+        """
+        if raw_name == name or self.aliases.get(raw_name) == name:
+            return False
+        races = self._sightings.setdefault((raw_name, name), set())
+        races.add(race_number)
+        if len(races) < ALIAS_CONFIRMATIONS:
+            return False
+        del self._sightings[(raw_name, name)]
+        return True
+
+    def learn(self, raw_name: str, name: str):
+        """Remember that raw_name is an OCR variant of name."""
+        if raw_name != name and self.aliases.get(raw_name) != name:
+            self.aliases[raw_name] = name
+            logging.debug(f"Learned alias '{raw_name}' -> '{name}'")
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import metrics
+from extract import ocr_settings_key
+from languages import covers
+
+
+def _encode(rankings: dict, lang_hint: str | None) -> str:
+    # JSON object keys are always strings, so store (rank, name) pairs to keep int ranks
+    return json.dumps({"lang": lang_hint, "rankings": list(rankings.items())}, ensure_ascii=False)
+
+
+def _decode(data: str) -> tuple[str | None, dict]:
+    entry = json.loads(data)
+    return entry["lang"], {rank: name for rank, name in entry["rankings"]}
+
+
+class OcrCache:
+    """
+    Content-addressed cache of parsed rankings, keyed by the image bytes and
+    the current OCR settings, so reposted screenshots skip OCR entirely. The
+    language hint an entry was OCRed with is stored in it: a lookup hits if
+    that hint's models cover those of the current hint (languages.covers), so
+    the same screenshot hits in another channel, or once its channel's hint
+    has changed.
+
+    The in-memory tier is an LRU bounded by the total size of the cached
+    entries. If `directory` is set, entries are also written there and
+    survive restarts. Methods may be called from several threads.
+    """
+
+    def __init__(self, max_bytes: int, directory: str | None = None):
+        self.max_bytes = max_bytes
+        self.directory = directory or None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # {key: encoded rankings}
+        self._size = 0
+        self._lock = threading.Lock()
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(image_bytes: bytes) -> str:
+        h = hashlib.sha256(ocr_settings_key().encode())
+        h.update(image_bytes)
+        return h.hexdigest()
+
+    def get(self, image_bytes: bytes, lang_hint: str | None = None) -> dict | None:
+        key = self.key(image_bytes)
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+        if data is None:
+            data = self._read_disk(key)
+            if data is not None:
+                self._remember(key, data)
+        if data is not None:
+            used_hint, rankings = _decode(data)
+            if not covers(used_hint, lang_hint):
+                data = None
+        if data is None:
+            self.misses += 1
+            metrics.inc("ocr_cache_miss")
+            logging.info(f"OCR cache miss {key[:12]} (hits: {self.hits}, misses: {self.misses})")
+            return None
+        self.hits += 1
+        metrics.inc("ocr_cache_hit")
+        logging.info(f"OCR cache hit {key[:12]} (hits: {self.hits}, misses: {self.misses})")
+        return rankings
+
+    def put(self, image_bytes: bytes, rankings: dict, lang_hint: str | None = None):
+        key = self.key(image_bytes)
+        data = _encode(rankings, lang_hint)
+        self._remember(key, data)
+        self._write_disk(key, data)
+
+    def _remember(self, key: str, data: str):
+        with self._lock:
+            if key in self._entries:
+                self._size -= len(self._entries.pop(key))
+            self._entries[key] = data
+            self._size += len(data)
+            # Evict least recently used entries until we are back under budget
+            while self._size > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _read_disk(self, key: str) -> str | None:
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logging.warning(f"Failed to read OCR cache entry {key}: {e}")
+            return None
+
+    def _write_disk(self, key: str, data: str):
+        if not self.directory:
+            return
+        tmp_path = self._path(key) + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            logging.warning(f"Failed to write OCR cache entry {key}: {e}")
@@ -0,0 +1,240 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+
+import metrics
+from extract import extract_rankings_from_bytes_timed, warm_up
+from ocr_cache import OcrCache
+from ocr_queue import OcrQueue
+from rows import extract_rankings_from_rows, new_rows, segment_rows_from_bytes
+
+
+class OcrQueueFull(Exception):
+    """The pool already holds `max_pending` waiting jobs; the message is not OCRed."""
+
+
+class OcrJob:
+    """
+    A batch of screenshots from one message waiting to be OCRed.
+    Await the job to get one rankings dict per image, in upload order.
+    """
+
+    def __init__(self, guild_id, images: list[bytes], position: int, results: list | None = None,
+                 lang_hint: str | None = None):
+        self.guild_id = guild_id
+        self.images = images
+        self.lang_hint = lang_hint
+        # Per-image rankings known before OCR (cache hits), None where OCR is needed
+        self.results = results or [None] * len(images)
+        # 1-based position among the waiting jobs at submission time
+        self.position = position
+        self.submitted = time.perf_counter()
+        self.future = asyncio.get_running_loop().create_future()
+
+    def __await__(self):
+        return self.future.__await__()
+
+
+class OcrPool:
+    """
+    Runs OCR in a process pool so Tesseract never blocks the Discord event loop.
+
+    Jobs are queued per guild and dispatched round-robin, so one guild uploading
+    a pile of screenshots cannot starve the others. At most `workers` jobs run at
+    once; the images of a running job are spread across the worker processes.
+    With an OcrQueue as `executor`, the limit is the number of connected
+    remote workers instead (at least one, so a job waits in the queue and
+    fails after its `queue_timeout` if none connects).
+    Past `max_queue` waiting jobs users are told they are queued; past
+    `max_pending`, submit() refuses new jobs, so a flood of uploads cannot
+    grow memory without bound. Images found in `cache` are not OCRed again,
+    and a message made only of cached images is answered without queueing
+    (nor starting the worker processes).
+
+    With `dedupe_rows`, a message with several screenshots to OCR is first
+    split into row strips (see rows.py) and rows already seen in an earlier
+    screenshot of the message are not OCRed again.
+
+    `func(image, lang_hint)` runs in the worker processes and returns
+    (rankings, {stage: seconds}).
+    """
+
+    def __init__(self, workers: int, max_queue: int, func=extract_rankings_from_bytes_timed,
+                 executor: Executor | None = None, cache: OcrCache | None = None, dedupe_rows: bool = False,
+                 max_pending: int | None = None):
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self.max_pending = max(max_queue, 4 * max_queue if max_pending is None else max_pending)
+        self.func = func
+        self.cache = cache
+        self.dedupe_rows = dedupe_rows
+        self._executor = executor
+        self._queues = OrderedDict()  # {guild_id: deque[OcrJob]}
+        self._pending = 0
+        self._running = 0
+        self._wakeup = None
+        self._dispatcher = None
+        self._tasks = set()
+        if isinstance(executor, OcrQueue):
+            executor.on_workers_changed = self._wake
+
+    @property
+    def capacity(self) -> int:
+        """Number of jobs that may run at once."""
+        if isinstance(self._executor, OcrQueue):
+            return max(1, self._executor.workers)
+        return self.workers
+
+    @property
+    def pending(self) -> int:
+        """Number of jobs waiting to be dispatched."""
+        return self._pending
+
+    @property
+    def running(self) -> int:
+        """Number of jobs currently being OCRed."""
+        return self._running
+
+    async def submit(self, guild_id, images: list[bytes], lang_hint: str | None = None) -> OcrJob:
+        """
+        Queue the images of one message. The cache lookup (hashing megabytes of
+        images, maybe reading from disk) runs in a thread, off the event loop.
+        `lang_hint` selects the OCR languages (see languages.py).
+        The caller can check `job.position > pool.max_queue` to tell the user
+        the job was queued behind a full queue. Raises OcrQueueFull if
+        `max_pending` jobs are already waiting.
+        """
+        results = await asyncio.to_thread(self._cached, images, lang_hint) if self.cache else None
+        if results and all(r is not None for r in results):
+            job = OcrJob(guild_id, images, 0, results, lang_hint)
+            job.future.set_result(results)
+            return job
+        if self._pending >= self.max_pending:
+            metrics.inc("ocr_jobs_rejected", guild_id)
+            raise OcrQueueFull(f"{self._pending} OCR jobs are already waiting")
+        self._ensure_started()
+        self._pending += 1
+        job = OcrJob(guild_id, images, self._pending, results, lang_hint)
+        self._queues.setdefault(guild_id, deque()).append(job)
+        self._wakeup.set()
+        return job
+
+    def _cached(self, images: list[bytes], lang_hint: str | None) -> list:
+        return [self.cache.get(img, lang_hint) for img in images]
+
+    async def warm_up(self):
+        """
+        Start the worker processes and load the OCR engine in each of them.
+        One warm-up task is sent per worker; a worker that is already warm
+        finishes it at once, so the others are likely to pick up the rest.
+        Remote workers of an OcrQueue warm up their own processes when they
+        start (see ocr_worker.py), and may not be connected yet.
+        """
+        if isinstance(self._executor, OcrQueue):
+            return
+        self._ensure_started()
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        backends = await asyncio.gather(*(loop.run_in_executor(self._executor, warm_up) for _ in range(self.workers)))
+        logging.info(f"Warmed up {self.workers} OCR workers ({backends[0]}) in {time.perf_counter() - start:.2f}s")
+
+    def close(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _ensure_started(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+
+    def _wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _next_job(self) -> OcrJob:
+        # Round-robin over guilds: take the oldest job of the first guild, then
+        # move that guild to the back of the line.
+        guild_id, jobs = next(iter(self._queues.items()))
+        job = jobs.popleft()
+        if jobs:
+            self._queues.move_to_end(guild_id)
+        else:
+            del self._queues[guild_id]
+        self._pending -= 1
+        return job
+
+    async def _dispatch(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._queues and self._running < self.capacity:
+                job = self._next_job()
+                self._running += 1
+                task = asyncio.create_task(self._run(job))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, job: OcrJob):
+        loop = asyncio.get_running_loop()
+        metrics.observe("ocr_queue_wait", time.perf_counter() - job.submitted, job.guild_id)
+        try:
+            with metrics.timed("ocr_job", job.guild_id):
+                missing = [i for i, r in enumerate(job.results) if r is None]
+                if self.dedupe_rows and len(missing) > 1:
+                    await self._ocr_rows(job, missing)
+                else:
+                    ocr_results = await asyncio.gather(
+                        *(loop.run_in_executor(self._executor, self.func, job.images[i], job.lang_hint) for i in missing)
+                    )
+                    for i, (rankings, timings) in zip(missing, ocr_results):
+                        await self._record(job, i, rankings, timings, complete=True)
+            if not job.future.done():
+                job.future.set_result(job.results)
+        except Exception as e:
+            logging.error(f"OCR job for guild {job.guild_id} failed: {e}")
+            if not job.future.done():
+                job.future.set_exception(e)
+        finally:
+            self._running -= 1
+            self._wakeup.set()
+
+    async def _record(self, job: OcrJob, i: int, rankings: dict, timings: dict, complete: bool):
+        for stage, seconds in timings.items():
+            metrics.observe(stage, seconds, job.guild_id)
+        job.results[i] = rankings
+        # Rankings missing the rows skipped as duplicates must not be reused for the image alone
+        if complete and self.cache is not None:
+            await asyncio.to_thread(self.cache.put, job.images[i], rankings, job.lang_hint)
+
+    async def _ocr_rows(self, job: OcrJob, missing: list[int]):
+        loop = asyncio.get_running_loop()
+        segmented = await asyncio.gather(
+            *(loop.run_in_executor(self._executor, segment_rows_from_bytes, job.images[i]) for i in missing)
+        )
+        for _, timings in segmented:
+            for stage, seconds in timings.items():
+                metrics.observe(stage, seconds, job.guild_id)
+        # Images without a detected table are OCRed whole
+        whole = [i for i, (strips, _) in zip(missing, segmented) if strips is None]
+        split = [(i, strips) for i, (strips, _) in zip(missing, segmented) if strips is not None]
+        unique = new_rows([strips for _, strips in split])
+        skipped = sum(len(strips) for _, strips in split) - sum(len(strips) for strips in unique)
+        if skipped:
+            metrics.inc("ocr_rows_skipped", job.guild_id, skipped)
+            logging.info(f"Skipping OCR of {skipped} rows repeated across the screenshots of one message")
+        ocr_results = await asyncio.gather(
+            *(loop.run_in_executor(self._executor, self.func, job.images[i], job.lang_hint) for i in whole),
+            *(loop.run_in_executor(self._executor, extract_rankings_from_rows, strips, job.lang_hint) for strips in unique),
+        )
+        for i, (rankings, timings) in zip(whole, ocr_results):
+            await self._record(job, i, rankings, timings, complete=True)
+        for (i, strips), new, (rankings, timings) in zip(split, unique, ocr_results[len(whole):]):
+            await self._record(job, i, rankings, timings, complete=len(new) == len(strips))
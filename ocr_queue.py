@@ -0,0 +1,352 @@
+"""
+Local job queue between the bot and standalone OCR workers (ocr_worker.py).
+
+The bot listens on a Unix socket ("unix:/path") or a TCP address
+("host:port") and OCR workers on any number of hosts connect to it and pull
+jobs one at a time per connection. OcrQueue is a concurrent.futures.Executor,
+so OcrPool uses it in place of its local process pool.
+
+Frames are a 4-byte big-endian length followed by the payload. A worker
+first sends a plain "token\nname" frame; after that, frames are JSON objects,
+with bytes, tuples, dicts with non-string keys and row strips written as
+tagged objects (see encode). Nothing received is executed: a worker only
+runs functions listed in FUNCTIONS. A TCP listener still requires a token,
+since whoever connects gets the screenshots and can answer with any result.
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import struct
+from collections import deque
+from concurrent.futures import Executor, Future
+
+import metrics
+from extract import extract_rankings_from_bytes_timed, warm_up
+from rows import RowStrip, extract_rankings_from_rows, segment_rows_from_bytes
+
+HEADER = struct.Struct(">I")
+MAX_FRAME_BYTES = 64 * 1024 * 1024
+HELLO_TIMEOUT = 10.0
+
+
+def _name(func) -> str:
+    return f"{func.__module__}.{func.__name__}"
+
+
+# Functions workers may run, by name
+FUNCTIONS = {_name(f): f for f in (extract_rankings_from_bytes_timed, segment_rows_from_bytes,
+                                   extract_rankings_from_rows, warm_up)}
+
+
+class OcrJobError(Exception):
+    """The job raised an exception in the worker; it is not retried."""
+
+
+async def read_raw_frame(reader: asyncio.StreamReader, max_bytes: int = MAX_FRAME_BYTES) -> bytes:
+    size, = HEADER.unpack(await reader.readexactly(HEADER.size))
+    if size > max_bytes:
+        raise ConnectionError(f"frame of {size} bytes exceeds {max_bytes}")
+    return await reader.readexactly(size)
+
+
+async def write_raw_frame(writer: asyncio.StreamWriter, data: bytes):
+    writer.write(HEADER.pack(len(data)) + data)
+    await writer.drain()
+
+
+def encode(value):
+    """
+    `value` as plain JSON types. Bytes become {"$bytes": base64}, tuples
+    {"$tuple": [...]}, dicts with keys other than strings (rankings by
+    position) or starting with "$" {"$dict": [[key, value], ...]}, and
+    RowStrips {"$strip": [hash, ink size, ink, size, pixels]}.
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, bytes):
+        return {"$bytes": base64.b64encode(value).decode("ascii")}
+    if isinstance(value, tuple):
+        return {"$tuple": [encode(v) for v in value]}
+    if isinstance(value, list):
+        return [encode(v) for v in value]
+    if isinstance(value, dict):
+        if all(isinstance(k, str) and not k.startswith("$") for k in value):
+            return {k: encode(v) for k, v in value.items()}
+        return {"$dict": [[encode(k), encode(v)] for k, v in value.items()]}
+    if isinstance(value, RowStrip):
+        return {"$strip": [encode(value.hash), list(value.ink_size), encode(value.ink), list(value.size),
+                           encode(value.pixels)]}
+    raise TypeError(f"cannot send {type(value).__name__} to OCR workers")
+
+
+def _decode_object(obj: dict):
+    if len(obj) != 1:
+        return obj
+    (tag, value), = obj.items()
+    if tag == "$bytes":
+        return base64.b64decode(value, validate=True)
+    if tag == "$tuple":
+        return tuple(value)
+    if tag == "$dict":
+        return {k: v for k, v in value}
+    if tag == "$strip":
+        hash, ink_size, ink, size, pixels = value
+        return RowStrip(hash, tuple(ink_size), ink, tuple(size), pixels)
+    return obj
+
+
+def decode(data: bytes):
+    """Inverse of encode, from a JSON document. Raises ValueError for malformed data."""
+    try:
+        return json.loads(data, object_hook=_decode_object)
+    except (TypeError, KeyError) as e:
+        raise ValueError(f"malformed frame: {e!r}") from e
+
+
+def decode_message(data: bytes) -> dict:
+    message = decode(data)
+    if not isinstance(message, dict):
+        raise ValueError("frame is not a JSON object")
+    return message
+
+
+def encode_message(message: dict) -> bytes:
+    return json.dumps(encode(message), separators=(",", ":")).encode()
+
+
+async def read_frame(reader: asyncio.StreamReader) -> dict:
+    return decode_message(await read_raw_frame(reader))
+
+
+async def write_frame(writer: asyncio.StreamWriter, message: dict):
+    await write_raw_frame(writer, encode_message(message))
+
+
+async def open_connection(address: str):
+    if address.startswith("unix:"):
+        return await asyncio.open_unix_connection(address[len("unix:"):])
+    host, _, port = address.rpartition(":")
+    return await asyncio.open_connection(host, int(port))
+
+
+def _hash_value(h, value):
+    # Bytes are hashed as they are (no base64 or JSON on the event loop), each
+    # value behind a type tag and a length so different arguments cannot collide
+    if isinstance(value, bytes):
+        h.update(b"b%d:" % len(value))
+        h.update(value)
+    elif isinstance(value, (list, tuple)):
+        h.update(b"l%d:" % len(value))
+        for v in value:
+            _hash_value(h, v)
+    elif isinstance(value, RowStrip):
+        h.update(b"r")
+        for v in (value.hash, value.ink_size, value.ink, value.size, value.pixels):
+            _hash_value(h, v)
+    else:
+        data = json.dumps(value).encode()
+        h.update(b"v%d:" % len(data))
+        h.update(data)
+
+
+def job_id(func_name: str, args: tuple) -> str:
+    """
+    Jobs are identified by their content, so resubmitting the same work reuses
+    the running job. Only a SHA-256 over the raw arguments runs on the event loop.
+    """
+    h = hashlib.sha256(func_name.encode())
+    _hash_value(h, args)
+    return h.hexdigest()
+
+
+class _Job:
+    __slots__ = ("id", "func", "args", "future", "attempts", "expiry", "frame")
+
+    def __init__(self, id: str, func: str, args: tuple):
+        self.id = id
+        self.func = func
+        self.args = args
+        self.future = Future()
+        self.attempts = 0
+        self.expiry = None  # timer failing the job while it waits for a worker
+        self.frame = None  # encoded job frame, kept for retries
+
+
+class OcrQueue(Executor):
+    """
+    Hands OCR calls to remote workers. submit() must be called from the event
+    loop thread (run_in_executor does). A job whose worker disconnects or does
+    not answer within `job_timeout` seconds is queued again, up to
+    `max_attempts` times in total; the connection of a timed-out worker is
+    closed, and the worker reconnects. A job that no worker takes within
+    `queue_timeout` seconds, e.g. because none is connected, fails with
+    TimeoutError. Submitting a job identical to one still pending returns
+    the pending job's future.
+
+    `workers` is the number of connected worker connections, each running one
+    job at a time; `on_workers_changed` is called when it changes.
+
+    Only a Unix socket may be served without a token: a TCP address without
+    one raises ValueError.
+    """
+
+    def __init__(self, address: str, token: str = "", job_timeout: float = 60.0, max_attempts: int = 3,
+                 queue_timeout: float = 120.0):
+        if not address.startswith("unix:") and not token:
+            raise ValueError(f"OCR queue on {address} needs VRI_OCR_QUEUE_TOKEN")
+        self.address = address
+        self.token = token
+        self.job_timeout = job_timeout
+        self.max_attempts = max_attempts
+        self.queue_timeout = queue_timeout
+        self.workers = 0
+        self.on_workers_changed = None
+        self._jobs = {}  # {job id: _Job}, pending and running
+        self._loop = None
+        self._queue = deque()
+        self._wakeup = None
+        self._server = None
+        self._writers = set()  # open worker connections
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        if self.address.startswith("unix:"):
+            self._server = await asyncio.start_unix_server(self._handle, self.address[len("unix:"):])
+        else:
+            host, _, port = self.address.rpartition(":")
+            self._server = await asyncio.start_server(self._handle, host, int(port))
+        logging.info(f"OCR queue listening on {self.address}")
+
+    @property
+    def pending(self) -> int:
+        return len(self._queue)
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        name = _name(fn)
+        if name not in FUNCTIONS or kwargs:
+            raise ValueError(f"{name} cannot be run by OCR workers")
+        if self._server is None:
+            raise RuntimeError("OCR queue is not started")
+        id = job_id(name, args)
+        job = self._jobs.get(id)
+        if job is None:
+            job = self._jobs[id] = _Job(id, name, args)
+            job.future.add_done_callback(lambda _: self._jobs.pop(id, None))
+            self._enqueue(job)
+        return job.future
+
+    def _enqueue(self, job: _Job, first: bool = False):
+        if first:
+            self._queue.appendleft(job)
+        else:
+            self._queue.append(job)
+        job.expiry = self._loop.call_later(self.queue_timeout, self._expire, job)
+        self._wakeup.set()
+
+    def _expire(self, job: _Job):
+        if job.future.done():
+            return
+        self._queue.remove(job)
+        metrics.inc("ocr_queue_expired")
+        logging.error(f"OCR job {job.id[:12]} waited {self.queue_timeout}s for a worker ({self.workers} connected)")
+        job.future.set_exception(TimeoutError(f"no OCR worker took the job within {self.queue_timeout}s"))
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        for job in list(self._jobs.values()):
+            if job.expiry is not None:
+                job.expiry.cancel()
+            job.future.cancel()
+        self._queue.clear()
+        # Workers see the connection close; idle handlers wake up and return
+        for writer in self._writers:
+            writer.close()
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _next_job(self) -> _Job | None:
+        while self._server is not None:
+            while self._queue:
+                job = self._queue.popleft()
+                job.expiry.cancel()
+                # Skip jobs cancelled while waiting
+                if not job.future.done():
+                    return job
+            self._wakeup.clear()
+            await self._wakeup.wait()
+        return None
+
+    def _retry(self, job: _Job, reason: str):
+        metrics.inc("ocr_queue_retries")
+        if job.future.done():
+            return
+        if job.attempts >= self.max_attempts:
+            logging.error(f"OCR job {job.id[:12]} failed after {job.attempts} attempts: {reason}")
+            job.future.set_exception(TimeoutError(f"OCR job failed after {job.attempts} attempts: {reason}"))
+            return
+        logging.warning(f"Retrying OCR job {job.id[:12]} ({reason})")
+        self._enqueue(job, first=True)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            # Nothing is parsed before the worker has shown the token
+            hello = await asyncio.wait_for(read_raw_frame(reader, 4096), HELLO_TIMEOUT)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        token, _, name = hello.decode("utf-8", "replace").partition("\n")
+        if not hmac.compare_digest(token.encode(), self.token.encode()):
+            logging.warning(f"Rejected OCR worker {name or '?'} with a wrong token")
+            writer.close()
+            return
+        self.workers += 1
+        self._writers.add(writer)
+        logging.info(f"OCR worker {name} connected ({self.workers} connected)")
+        self._workers_changed()
+        try:
+            while True:
+                job = await self._next_job()
+                if job is None:
+                    return
+                job.attempts += 1
+                try:
+                    # Base64 and JSON of megabytes of screenshots run in a thread, off the event loop
+                    if job.frame is None:
+                        job.frame = await asyncio.to_thread(
+                            encode_message, {"type": "job", "id": job.id, "func": job.func, "args": job.args})
+                    await write_raw_frame(writer, job.frame)
+                    data = await asyncio.wait_for(read_raw_frame(reader), self.job_timeout)
+                    reply = await asyncio.to_thread(decode_message, data)
+                except asyncio.TimeoutError:
+                    self._retry(job, f"no answer from {name} within {self.job_timeout}s")
+                    return
+                except (asyncio.IncompleteReadError, ConnectionError, ValueError) as e:
+                    self._retry(job, f"worker {name} disconnected: {e!r}")
+                    return
+                if reply.get("id") != job.id:
+                    self._retry(job, f"unexpected reply from {name}")
+                    return
+                if job.future.done():
+                    # Cancelled while the worker was busy with it
+                    continue
+                if reply.get("ok"):
+                    job.future.set_result(reply["value"])
+                else:
+                    job.future.set_exception(OcrJobError(reply.get("error", "unknown error")))
+        finally:
+            self.workers -= 1
+            self._writers.discard(writer)
+            logging.info(f"OCR worker {name} disconnected ({self.workers} connected)")
+            writer.close()
+            self._workers_changed()
+
+    def _workers_changed(self):
+        if self.on_workers_changed is not None:
+            self.on_workers_changed()
+
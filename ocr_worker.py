@@ -0,0 +1,89 @@
+"""
+Standalone OCR worker: pulls jobs from the bot's OCR queue (see ocr_queue.py)
+and runs them in a local process pool.
+
+    python ocr_worker.py --connect unix:/tmp/vri-ocr.sock -j 4
+    VRI_OCR_QUEUE=bot-host:8765 VRI_OCR_QUEUE_TOKEN=... python ocr_worker.py
+
+Each of the -j connections takes one job at a time. Start as many workers,
+on as many hosts, as needed; lost connections are retried until stopped.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import socket
+from concurrent.futures import Executor, ProcessPoolExecutor
+
+import config
+from extract import warm_up
+from ocr_queue import FUNCTIONS, open_connection, read_frame, write_frame, write_raw_frame
+
+RECONNECT_DELAY = 1.0
+MAX_RECONNECT_DELAY = 30.0
+
+
+async def serve_jobs(address: str, token: str, executor: Executor, name: str):
+    """
+    Run jobs from one queue connection until it closes. Returns the number of
+    jobs done.
+    """
+    loop = asyncio.get_running_loop()
+    reader, writer = await open_connection(address)
+    done = 0
+    try:
+        await write_raw_frame(writer, f"{token}\n{name}".encode())
+        while True:
+            try:
+                job = await read_frame(reader)
+            except asyncio.IncompleteReadError:
+                return done
+            try:
+                value = await loop.run_in_executor(executor, FUNCTIONS[job["func"]], *job["args"])
+                reply = {"id": job["id"], "ok": True, "value": value}
+            except Exception as e:
+                logging.error(f"OCR job {job['id'][:12]} failed: {e!r}")
+                reply = {"id": job["id"], "ok": False, "error": f"{type(e).__name__}: {e}"}
+            await write_frame(writer, reply)
+            done += 1
+    finally:
+        writer.close()
+
+
+async def run_connection(address: str, token: str, executor: Executor, name: str):
+    """Keep one queue connection open, reconnecting with backoff."""
+    delay = RECONNECT_DELAY
+    while True:
+        try:
+            done = await serve_jobs(address, token, executor, name)
+            logging.info(f"{name}: queue closed the connection after {done} jobs")
+            delay = RECONNECT_DELAY
+        except (OSError, ConnectionError, ValueError) as e:
+            logging.warning(f"{name}: lost the OCR queue at {address}: {e!r}")
+            delay = min(delay * 2, MAX_RECONNECT_DELAY)
+        await asyncio.sleep(delay)
+
+
+async def run(address: str, token: str, connections: int):
+    name = f"{socket.gethostname()}:{os.getpid()}"
+    with ProcessPoolExecutor(max_workers=connections) as executor:
+        # Load the OCR engine in every process before taking jobs
+        loop = asyncio.get_running_loop()
+        backends = await asyncio.gather(*(loop.run_in_executor(executor, warm_up) for _ in range(connections)))
+        logging.info(f"{name}: warmed up {connections} OCR processes ({backends[0]})")
+        await asyncio.gather(*(run_connection(address, token, executor, f"{name}/{i}") for i in range(connections)))
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connect", default=config.OCR_QUEUE, help="queue address, unix:/path or host:port")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="jobs run at the same time")
+    args = parser.parse_args(argv)
+    if not args.connect:
+        parser.error("no queue address: use --connect or set VRI_OCR_QUEUE")
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s:%(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+    asyncio.run(run(args.connect, config.OCR_QUEUE_TOKEN, max(1, args.jobs)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Ranking rows parsed from OCR text and from the bot's "Ranking:" replies.
+
+Each format has one precompiled pattern, anchored at line starts and run
+over the whole text with finditer, so a text is scanned once instead of
+line by line with several backtracking patterns. Rows come back as
+RankingRow tuples, which the OCR path (extract.py) and the reaction path
+(main.py) turn into their dicts with by_rank and by_name.
+"""
+import re
+from typing import Iterable, NamedTuple
+
+# Part of extract.ocr_settings_key: bump when parsed rows may change, so cached OCR results are redone
+PARSER_VERSION = 2
+
+# OCR rows, in either format of the VRI results screen:
+#   "6. FR Guest_1723161531080 +00:15.2 29 pts"  rank, dot, optional flag token, name, time and points
+#   "6 - Guest_1723161531080", "DSQ - Guest_1723161531080"
+# A few non-digit characters of OCR noise may precede the rank. A name ends
+# before a time ("+...") or a trailing DSQ, and never starts with "+", so a
+# row without a flag does not lose its name to the flag token.
+OCR_ROW = re.compile(r"""
+    ^[^\d\n]{0,3}?
+    (?:
+        (?P<status>DSQ|DNF|DNS) [^\S\n]* [-–—] [^\S\n]*
+      | (?P<rank>\d{1,2}) (?: [^\S\n]* [-–—] [^\S\n]* | \. [^\S\n]+ (?: \S+ [^\S\n]+ )? )
+    )
+    (?P<name> [^\s+] .*? )
+    (?: [^\S\n]+ (?: \+ | DSQ\b ) .* )?
+    [^\S\n]*$
+""", re.MULTILINE | re.VERBOSE)
+
+# Rows of a ranking reply, as written by extract.format_rankings: "6 Name" or "DSQ Name"
+REPLY_ROW = re.compile(r"^[^\S\n]*(?:(?P<status>DSQ|DNF|DNS)|(?P<rank>\d+))[^\S\n]+(?P<name>\S(?:.*\S)?)", re.MULTILINE)
+
+
+class RankingRow(NamedTuple):
+    """One row of a ranking: a finishing position, or rank None and a status ('DSQ', 'DNF', 'DNS')."""
+    rank: int | None
+    name: str
+    status: str | None = None
+
+    @property
+    def result(self) -> int | str:
+        """The position, or the status for non-finishers."""
+        return self.rank if self.status is None else self.status
+
+
+def _rows(pattern: re.Pattern, text: str) -> list[RankingRow]:
+    # Both patterns capture (status, rank, name), with '' for the missing one of status and rank.
+    # tuple.__new__ skips the keyword handling of RankingRow(...), which dominates on long texts
+    new = tuple.__new__
+    return [new(RankingRow, (int(rank) if rank else None, name, status or None))
+            for status, rank, name in pattern.findall(text)]
+
+
+def parse_ocr_text(text: str) -> list[RankingRow]:
+    """Rows of one OCR'd screenshot, in text order; other lines are ignored."""
+    return _rows(OCR_ROW, text)
+
+
+def parse_ocr_texts(texts: Iterable[str]) -> list[list[RankingRow]]:
+    """parse_ocr_text over many texts, e.g. all screenshots of a batch."""
+    return [_rows(OCR_ROW, text) for text in texts]
+
+
+def parse_reply(text: str) -> list[RankingRow]:
+    """Rows of a ranking reply; the "Ranking:" header and other lines are ignored."""
+    return _rows(REPLY_ROW, text)
+
+
+def by_rank(rows: Iterable[RankingRow]) -> dict:
+    """{position or status: name}, as OCR results are kept; a later row wins."""
+    return {rank if status is None else status: name for rank, name, status in rows}
+
+
+def by_name(rows: Iterable[RankingRow]) -> dict:
+    """
+    {name: position or status}, as races are stored. DNS rows are left out:
+    a participant missing from a race already counts as not started.
+    """
+    return {name: rank if status is None else status for rank, name, status in rows if status != "DNS"}
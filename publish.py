@@ -0,0 +1,198 @@
+import asyncio
+import logging
+from io import BytesIO
+
+import metrics
+
+TABLE_FILENAME = "race_table.png"
+
+
+class RateLimited(Exception):
+    """
+    Raised by a transport when Discord answered 429. `retry_after` is in seconds;
+    a global limit blocks every channel, otherwise only the channel's bucket.
+    """
+
+    def __init__(self, retry_after: float, is_global: bool = False):
+        super().__init__(f"rate limited for {retry_after:.2f}s{' (global)' if is_global else ''}")
+        self.retry_after = retry_after
+        self.is_global = is_global
+
+
+class MessageGone(Exception):
+    """Raised by a transport when the message no longer exists."""
+
+
+class DiscordTransport:
+    """
+    The three Discord calls the publisher needs, through discord.py. Messages are
+    addressed by ID with partial messages, so no call fetches the message first.
+    """
+
+    async def edit(self, channel, message_id: int, image: bytes):
+        import discord
+        try:
+            await channel.get_partial_message(message_id).edit(
+                attachments=[discord.File(BytesIO(image), filename=TABLE_FILENAME)])
+        except discord.NotFound as e:
+            raise MessageGone(str(e)) from e
+        except discord.HTTPException as e:
+            self._raise_rate_limited(e)
+            raise
+
+    async def post(self, reply_to, image: bytes) -> int:
+        import discord
+        try:
+            sent_message = await reply_to.reply(file=discord.File(BytesIO(image), filename=TABLE_FILENAME))
+        except discord.HTTPException as e:
+            self._raise_rate_limited(e)
+            raise
+        return sent_message.id
+
+    async def delete(self, channel, message_id: int):
+        import discord
+        try:
+            await channel.get_partial_message(message_id).delete()
+        except discord.NotFound as e:
+            raise MessageGone(str(e)) from e
+        except discord.HTTPException as e:
+            self._raise_rate_limited(e)
+            raise
+
+    @staticmethod
+    def _raise_rate_limited(e):
+        # discord.py already waits out most rate limits; this is what is left after its retries
+        if e.status == 429:
+            headers = getattr(e.response, "headers", {})
+            raise RateLimited(float(headers.get("Retry-After", 1.0)), headers.get("X-RateLimit-Global") == "true") from e
+
+
+class _Version:
+    __slots__ = ("image", "reply_to", "message_id")
+
+    def __init__(self, image: bytes, reply_to, message_id: int | None):
+        self.image = image
+        self.reply_to = reply_to
+        self.message_id = message_id
+
+
+class TablePublisher:
+    """
+    Sends rendered race tables to Discord, one queue per channel.
+
+    A table replaces the channel's previous table message by editing its
+    attachment in place (one API call). If there is no table message yet or
+    it was deleted, a new reply is posted; if it exists but cannot be edited,
+    a new reply is posted and the old message deleted. While a channel's
+    table is being sent, only the newest pending version is kept: older ones
+    are dropped instead of being sent just to be overwritten. On a 429 the channel (or every channel, for
+    a global limit) waits `retry_after` and then sends the newest version.
+
+    `on_published(channel_key, message_id)` is awaited after each successful
+    send, so the caller can store the ID of the table message.
+    """
+
+    def __init__(self, transport=None, on_published=None, max_attempts: int = 5):
+        self.transport = transport or DiscordTransport()
+        self.on_published = on_published
+        self.max_attempts = max_attempts
+        self._pending = {}  # {channel_key: _Version}
+        self._message_ids = {}  # {channel_key: table message ID sent by this publisher}
+        self._generations = {}  # {channel_key: bumped by discard() to ignore sends in flight}
+        self._workers = {}  # {channel_key: asyncio.Task}
+        self._not_before = {}  # {channel_key or None for global: loop time}
+
+    def publish(self, channel_key, image: bytes, reply_to, message_id: int | None = None):
+        """
+        Queue a table image for a channel. `reply_to` is the message a new
+        table is posted in reply to; `message_id` is the current table
+        message, used unless this publisher has sent a newer one since.
+        """
+        if channel_key in self._pending:
+            metrics.inc("tables_superseded", channel_key[0])
+            logging.info(f"Dropping superseded race table for channel {channel_key}")
+        self._pending[channel_key] = _Version(image, reply_to, message_id)
+        if channel_key not in self._workers:
+            self._workers[channel_key] = asyncio.get_running_loop().create_task(self._run(channel_key))
+
+    def discard(self, channel_key):
+        """
+        Forget the channel's pending table and table message, e.g. after a
+        reset, so the next table is posted as a new message.
+        """
+        self._pending.pop(channel_key, None)
+        self._message_ids.pop(channel_key, None)
+        self._generations[channel_key] = self._generations.get(channel_key, 0) + 1
+
+    async def join(self):
+        """Wait until every queued table has been sent (or given up on)."""
+        while self._workers:
+            await asyncio.gather(*self._workers.values(), return_exceptions=True)
+
+    async def _wait_for_bucket(self, channel_key):
+        loop = asyncio.get_running_loop()
+        while (delay := max(self._not_before.get(channel_key, 0), self._not_before.get(None, 0)) - loop.time()) > 0:
+            await asyncio.sleep(delay)
+
+    async def _run(self, channel_key):
+        loop = asyncio.get_running_loop()
+        attempts = 0
+        try:
+            while channel_key in self._pending:
+                await self._wait_for_bucket(channel_key)
+                version = self._pending.pop(channel_key, None)
+                if version is None:
+                    continue
+                generation = self._generations.get(channel_key, 0)
+                try:
+                    with metrics.timed("publish", channel_key[0]):
+                        message_id = await self._send(channel_key, version)
+                except RateLimited as e:
+                    attempts += 1
+                    metrics.inc("publish_rate_limited", channel_key[0])
+                    logging.warning(f"Publishing race table for channel {channel_key}: {e}")
+                    self._not_before[None if e.is_global else channel_key] = loop.time() + e.retry_after
+                    if attempts < self.max_attempts and self._generations.get(channel_key, 0) == generation:
+                        # Retry unless a newer version arrived (or the channel was reset) meanwhile
+                        self._pending.setdefault(channel_key, version)
+                    continue
+                except Exception as e:
+                    logging.error(f"Failed to publish race table for channel {channel_key}: {e!r}")
+                    continue
+                attempts = 0
+                if self._generations.get(channel_key, 0) != generation:
+                    # Discarded while sending: this message belongs to the previous regatta
+                    continue
+                self._message_ids[channel_key] = message_id
+                if self.on_published is not None:
+                    await self.on_published(channel_key, message_id)
+        finally:
+            del self._workers[channel_key]
+
+    async def _send(self, channel_key, version: _Version) -> int:
+        message_id = self._message_ids.get(channel_key, version.message_id)
+        channel = version.reply_to.channel
+        stale_id = None
+        if message_id is not None:
+            try:
+                await self.transport.edit(channel, message_id, version.image)
+                metrics.inc("tables_edited", channel_key[0])
+                logging.info(f"Edited race table message {message_id} for channel {channel_key}")
+                return message_id
+            except MessageGone:
+                logging.warning(f"Race table message {message_id} for channel {channel_key} is gone, posting a new one")
+            except RateLimited:
+                raise
+            except Exception as e:
+                logging.warning(f"Cannot edit race table message {message_id} for channel {channel_key} ({e!r}), replacing it")
+                stale_id = message_id
+            self._message_ids.pop(channel_key, None)
+        new_id = await self.transport.post(version.reply_to, version.image)
+        metrics.inc("tables_posted", channel_key[0])
+        logging.info(f"Posted new race table message {new_id} for channel {channel_key}")
+        if stale_id is not None:
+            try:
+                await self.transport.delete(channel, stale_id)
+            except Exception as e:
+                logging.warning(f"Failed to delete previous race table message {stale_id}: {e!r}")
+        return new_id
@@ -0,0 +1,82 @@
+"""
+Rebuild regattas from channel history, e.g. after the bot lost its state.
+
+The history of a channel is read back from the newest message to the last
+`!reset`. Every ranking message the bot posted with number-emoji reactions
+is a race, as if the reactions were added again, and the bot's newest race table message is
+picked up so the rebuilt table replaces it in place.
+"""
+import asyncio
+import logging
+import time
+
+from publish import TABLE_FILENAME
+
+
+class RecoveredChannel:
+    """Races found in the history of one channel."""
+
+    def __init__(self):
+        self.races = {}  # {race_number: parsed ranking}, oldest ranking message first
+        self.message = None  # newest ranking message, replied to if a new table is posted
+        self.table_message_id = None  # newest race table posted by the bot
+        self.scanned = 0
+
+
+async def scan_history(channel, bot_user_id: int, emoji_to_race: dict, parse_ranking, limit: int | None) -> RecoveredChannel:
+    """
+    Read up to `limit` messages of a channel, newest first, stopping at the
+    last `!reset`. Only rankings posted by the bot count, so a ranking pasted
+    by a user cannot be replayed as a result. `parse_ranking` turns a ranking
+    message's text into {name: rank}. If several messages are labelled with
+    the same race, the newest one wins, as a later reaction would in the
+    live bot.
+    """
+    found = RecoveredChannel()
+    newest_first = []  # [(race_number, ranking)]
+    async for message in channel.history(limit=limit):
+        found.scanned += 1
+        if message.content.strip() == "!reset" and not message.author.bot:
+            break
+        if message.author.id == bot_user_id and found.table_message_id is None \
+                and any(a.filename == TABLE_FILENAME for a in message.attachments):
+            found.table_message_id = message.id
+            continue
+        if message.author.id != bot_user_id or "Ranking:" not in message.content:
+            continue
+        races = [emoji_to_race[r.emoji] for r in message.reactions if r.emoji in emoji_to_race]
+        if not races:
+            continue
+        ranking = parse_ranking(message.content)
+        if not ranking:
+            continue
+        if found.message is None:
+            found.message = message
+        newest_first += [(race, ranking) for race in races]
+    for race, ranking in reversed(newest_first):
+        # Re-inserting moves the race to the position of its newest message
+        found.races.pop(race, None)
+        found.races[race] = ranking
+    return found
+
+
+async def recover_channels(channels, recover_channel, concurrency: int) -> int:
+    """
+    Run `recover_channel(channel)` over many channels, at most `concurrency`
+    at a time, so history requests stay within Discord's rate limits. Returns
+    the total of what recover_channel returned (e.g. recovered races).
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    start = time.perf_counter()
+
+    async def run(channel):
+        async with semaphore:
+            try:
+                return await recover_channel(channel)
+            except Exception as e:
+                logging.error(f"Failed to recover channel {getattr(channel, 'id', channel)}: {e!r}")
+                return 0
+
+    recovered = sum(await asyncio.gather(*(run(channel) for channel in channels)))
+    logging.info(f"Recovered {recovered} races from {len(channels)} channels in {time.perf_counter() - start:.1f}s")
+    return recovered
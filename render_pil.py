@@ -0,0 +1,95 @@
+import os
+from functools import lru_cache
+from io import BytesIO
+
+from typing import TYPE_CHECKING
+
+from PIL import Image, ImageDraw, ImageFont
+
+import config
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Same look as the matplotlib table in main.render_table_image
+FONT_SIZE = 20
+CELL_PADDING_X = 14
+ROW_HEIGHT = 36
+BAND_COLOR = "#CCFF99"
+TEXT_COLOR = "black"
+
+# Noto Sans CJK (fonts-noto-cjk) covers Latin, Cyrillic, Chinese and Japanese names
+REGULAR_FONTS = [
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/google-noto-cjk/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+]
+BOLD_FONTS = [
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Bold.ttc",
+    "/usr/share/fonts/noto-cjk/NotoSansCJK-Bold.ttc",
+    "/usr/share/fonts/google-noto-cjk/NotoSansCJK-Bold.ttc",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+]
+
+
+@lru_cache(maxsize=None)
+def load_font(bold: bool, size: int = FONT_SIZE):
+    """
+    Load the table font once per process. Returns (font, fake_bold): when no
+    bold face is found, bold text is drawn with a stroke instead.
+    """
+    candidates = ([config.TABLE_FONT_BOLD] if bold else [config.TABLE_FONT]) + (BOLD_FONTS if bold else REGULAR_FONTS)
+    for path in candidates:
+        if path and os.path.exists(path):
+            # Index 0 of the Noto CJK collections is the JP variant
+            return ImageFont.truetype(path, size, index=0), False
+    if bold:
+        return load_font(False, size)[0], True
+    return ImageFont.load_default(size), False
+
+
+@lru_cache(maxsize=4096)
+def text_width(text: str, bold: bool) -> int:
+    """Width of a glyph run in pixels, measured once per process."""
+    font, fake_bold = load_font(bold)
+    return int(font.getlength(text)) + (2 if fake_bold else 0)
+
+
+def render_table_image_pil(df: 'pd.DataFrame') -> BytesIO:
+    """
+    Render a race table DataFrame as a PNG image directly with Pillow.
+    Draws the same layout as render_table_image: a rank column, left-aligned
+    names, light lime banding on odd rows and a bold "Total" column.
+    """
+    header = ["Rank"] + [f"Race {col}" if col.isdigit() else col for col in df.columns]
+    rows = [[str(i)] + [str(v) for v in values] for i, values in enumerate(df.itertuples(index=False, name=None), start=1)]
+    last_col = len(header) - 1
+
+    widths = []
+    for j, title in enumerate(header):
+        bold = j == last_col
+        widths.append(max(text_width(cell, bold) for cell in [title] + [row[j] for row in rows]) + 2 * CELL_PADDING_X)
+    lefts = [sum(widths[:j]) for j in range(len(widths))]
+
+    img = Image.new("RGB", (sum(widths), ROW_HEIGHT * (len(rows) + 1)), "white")
+    draw = ImageDraw.Draw(img)
+    for i, row in enumerate([header] + rows):
+        top = i * ROW_HEIGHT
+        if i % 2 == 1:
+            draw.rectangle((0, top, img.width, top + ROW_HEIGHT - 1), fill=BAND_COLOR)
+        for j, cell in enumerate(row):
+            bold = j == last_col
+            font, fake_bold = load_font(bold)
+            # Names are left-aligned (except the header), everything else is centered
+            if j == 1 and i > 0:
+                x = lefts[j] + CELL_PADDING_X
+            else:
+                x = lefts[j] + (widths[j] - text_width(cell, bold)) / 2
+            draw.text((x, top + ROW_HEIGHT / 2), cell, font=font, fill=TEXT_COLOR, anchor="lm",
+                      stroke_width=1 if fake_bold else 0, stroke_fill=TEXT_COLOR)
+
+    buf = BytesIO()
+    img.save(buf, format="PNG")
+    buf.seek(0)
+    return buf
@@ -0,0 +1,179 @@
+"""
+Row-level OCR of multi-screenshot uploads.
+
+Long lobbies are posted as several scrolled screenshots that overlap by many
+rows. Each screenshot is split into one strip per text row and every strip is
+fingerprinted with a perceptual hash of its ink; a row whose hash and ink
+pixels match a row of an earlier screenshot of the same upload is not OCRed
+again. The new rows of
+each screenshot are stacked back into one image and OCRed in a single call.
+"""
+import time
+
+import numpy as np
+from PIL import Image
+
+from extract import (TARGET_LINE_HEIGHT, THRESHOLD, binarize, cjk_score, decode_screenshot, find_text_lines,
+                     get_backend, locate_ranking_region, parse_rankings_from_text)
+from languages import resolve as resolve_language
+
+# Grid the ink of a row is resized to before hashing: (columns + 1) x rows
+HASH_COLUMNS = 64
+HASH_ROWS = 8
+# Two strips with the same hash are the same row only if their ink boxes have
+# about the same size (relative tolerance), since the hash ignores scale
+SIZE_TOLERANCE = 0.04
+# ...and about the same pixels: the largest mean absolute difference of a
+# column of the ink boxes, out of 255. A glyph that differs (one digit of a
+# name) leaves columns far apart, while a row repeated across screenshots is
+# identical up to compression noise.
+INK_TOLERANCE = 24
+
+
+class RowStrip:
+    """
+    One text row of a preprocessed screenshot: the grayscale pixels of the
+    full-width band for OCR, and the hash, size and full-resolution pixels of
+    its ink for matching.
+    """
+    __slots__ = ("hash", "ink_size", "ink", "size", "pixels")
+
+    def __init__(self, hash: bytes, ink_size: tuple[int, int], ink: bytes, size: tuple[int, int], pixels: bytes):
+        self.hash = hash
+        self.ink_size = ink_size
+        self.ink = ink
+        self.size = size
+        self.pixels = pixels
+
+    def image(self):
+        return Image.frombytes('L', self.size, self.pixels)
+
+    def ink_array(self) -> np.ndarray:
+        return np.frombuffer(self.ink, dtype=np.uint8).reshape(self.ink_size[1], self.ink_size[0])
+
+    def same_row(self, other: "RowStrip") -> bool:
+        """
+        The hash only finds candidates: rows differing in one digit often
+        share it, so the ink boxes are compared pixel by pixel as well.
+        """
+        if self.hash != other.hash:
+            return False
+        if not all(abs(a - b) <= max(2, SIZE_TOLERANCE * max(a, b)) for a, b in zip(self.ink_size, other.ink_size)):
+            return False
+        mine, theirs = self.ink_array(), other.ink_array()
+        if theirs.shape != mine.shape:
+            theirs = np.asarray(Image.fromarray(theirs).resize(self.ink_size, Image.Resampling.BILINEAR))
+        difference = np.abs(mine.astype(np.int16) - theirs).mean(axis=0)
+        return float(difference.max()) <= INK_TOLERANCE
+
+
+def row_hash(gray: np.ndarray):
+    """
+    Difference hash of the ink of a row strip: the strip is cut to the box of
+    its text pixels, resized to a small grid, and each bit tells whether a
+    cell is brighter than its right neighbour. Returns (hash, ink size, ink
+    pixels), or None if the strip has no text.
+    """
+    binary = gray >= THRESHOLD
+    # Text is whatever differs from the dominant (background) level of the strip
+    ink = binary != (np.count_nonzero(binary) * 2 > binary.size)
+    columns = np.flatnonzero(ink.any(axis=0))
+    rows = np.flatnonzero(ink.any(axis=1))
+    if columns.size == 0:
+        return None
+    box = gray[rows[0]:rows[-1] + 1, columns[0]:columns[-1] + 1]
+    grid = np.asarray(Image.fromarray(box).resize((HASH_COLUMNS + 1, HASH_ROWS), Image.Resampling.BOX), dtype=np.int16)
+    bits = grid[:, 1:] > grid[:, :-1]
+    return np.packbits(bits).tobytes(), (box.shape[1], box.shape[0]), box.tobytes()
+
+
+def segment_rows(gray: np.ndarray, scale: float = 1.0) -> list[RowStrip]:
+    """
+    Split a grayscale array cropped to the results table into row strips.
+    Band boundaries are placed halfway between consecutive text lines. Rows
+    are hashed at full resolution, where a row looks the same in every
+    screenshot, and then scaled by `scale` for OCR.
+    """
+    lines = find_text_lines(gray)
+    strips = []
+    for i, (top, bottom) in enumerate(lines):
+        pad = (bottom - top) // 2
+        start = (lines[i - 1][1] + top) // 2 if i > 0 else max(0, top - pad)
+        end = (bottom + lines[i + 1][0]) // 2 if i + 1 < len(lines) else min(gray.shape[0], bottom + pad)
+        band = gray[start:end]
+        fingerprint = row_hash(band)
+        if fingerprint is None:
+            continue
+        img = Image.fromarray(band)
+        if scale < 1.0:
+            size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+            img = img.resize(size, Image.Resampling.LANCZOS)
+        strips.append(RowStrip(*fingerprint, img.size, img.tobytes()))
+    return strips
+
+
+def segment_rows_from_bytes(image_bytes):
+    """
+    Worker side: crop a screenshot to the results table and split it into
+    row strips scaled like extract.crop_to_ranking_region does. Returns
+    (strips, {"preprocess": seconds}), or (None, timings) if no table is found.
+    """
+    start = time.perf_counter()
+    img = decode_screenshot(image_bytes)
+    region = locate_ranking_region(img)
+    strips = None
+    if region is not None:
+        box, line_height = region
+        strips = segment_rows(np.asarray(img.crop(box)), min(1.0, TARGET_LINE_HEIGHT / line_height))
+    return strips, {"preprocess": time.perf_counter() - start}
+
+
+def new_rows(strips_per_image: list[list[RowStrip]]) -> list[list[RowStrip]]:
+    """
+    For each image of an upload, keep the strips not seen in an earlier image.
+    """
+    seen = {}  # {hash: [RowStrip]}
+    result = []
+    for strips in strips_per_image:
+        result.append([s for s in strips if not any(s.same_row(t) for t in seen.get(s.hash, ()))])
+        for s in strips:
+            seen.setdefault(s.hash, []).append(s)
+    return result
+
+
+def stack_rows(strips: list[RowStrip]):
+    """Stack strips vertically into one grayscale image, left aligned."""
+    width = max(s.size[0] for s in strips)
+    height = sum(s.size[1] for s in strips)
+    # Fill with the background level of the first strip, so gaps look like the table
+    background = int(np.median(np.frombuffer(strips[0].pixels, dtype=np.uint8)))
+    img = Image.new('L', (width, height), background)
+    y = 0
+    for s in strips:
+        img.paste(s.image(), (0, y))
+        y += s.size[1]
+    return img
+
+
+def extract_rankings_from_rows(strips: list[RowStrip], lang_hint: str | None = None):
+    """
+    Worker side: OCR row strips stacked into one image.
+    Returns (rankings, {"preprocess": s, "tesseract": s, "parse": s}) like
+    extract.extract_rankings_from_bytes_timed, which `lang_hint` is also passed like.
+    """
+    if not strips:
+        return {}, {}
+    start = time.perf_counter()
+    stacked = stack_rows(strips)
+    lang = 'eng' if lang_hint is None else resolve_language(lang_hint, cjk_score(np.asarray(stacked)))
+    image = binarize(stacked)
+    preprocessed = time.perf_counter()
+    text = get_backend().image_to_text(image, lang=lang)
+    recognized = time.perf_counter()
+    rankings = parse_rankings_from_text(text)
+    timings = {
+        "preprocess": preprocessed - start,
+        "tesseract": recognized - preprocessed,
+        "parse": time.perf_counter() - recognized,
+    }
+    return rankings, timings
@@ -0,0 +1,73 @@
+import asyncio
+import logging
+from collections import defaultdict
+
+
+class TableUpdateScheduler:
+    """
+    Coalesces bursts of race reactions into one table rebuild per channel.
+
+    Each scheduled race update restarts the channel's debounce window (up to
+    `max_delay` after the first update). When the window closes, all pending
+    updates are handed to `flush(channel_key, updates, message)` together,
+    where `updates` maps race numbers to parsed rankings and `message` is the
+    latest ranking message reacted to. Flushes of one channel never overlap:
+    they run under the channel lock, which other handlers changing the
+    channel's regatta (e.g. `!reset`) should hold too.
+    """
+
+    def __init__(self, flush, debounce: float, max_delay: float | None = None):
+        self.flush = flush
+        self.debounce = debounce
+        self.max_delay = max_delay if max_delay is not None else 4 * debounce
+        self._pending = {}  # {channel_key: {race_number: ranking}}
+        self._messages = {}  # {channel_key: latest ranking message}
+        self._deadlines = {}  # {channel_key: (window end, latest allowed end)}
+        self._timers = {}  # {channel_key: asyncio.Task}
+        self._locks = defaultdict(asyncio.Lock)
+
+    def lock(self, channel_key) -> asyncio.Lock:
+        return self._locks[channel_key]
+
+    def schedule(self, channel_key, race_number, ranking: dict, message):
+        """
+        Queue a race update. A later update of the same race in the same
+        window replaces the earlier one.
+        """
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        self._pending.setdefault(channel_key, {})[race_number] = ranking
+        self._messages[channel_key] = message
+        _, latest = self._deadlines.get(channel_key, (None, now + self.max_delay))
+        self._deadlines[channel_key] = (min(now + self.debounce, latest), latest)
+        if channel_key not in self._timers:
+            self._timers[channel_key] = loop.create_task(self._run(channel_key))
+
+    def discard(self, channel_key):
+        """
+        Drop the updates of a channel that have not been flushed yet.
+        """
+        self._pending.pop(channel_key, None)
+        self._messages.pop(channel_key, None)
+
+    async def _run(self, channel_key):
+        loop = asyncio.get_running_loop()
+        try:
+            while (delay := self._deadlines[channel_key][0] - loop.time()) > 0:
+                await asyncio.sleep(delay)
+            async with self._locks[channel_key]:
+                # Updates arriving from now on open a new window, flushed after this one
+                del self._timers[channel_key]
+                del self._deadlines[channel_key]
+                updates = self._pending.pop(channel_key, None)
+                message = self._messages.pop(channel_key, None)
+                if updates:
+                    logging.info(f"Applying races {sorted(updates)} to channel {channel_key} in one update")
+                    await self.flush(channel_key, updates, message)
+        except Exception as e:
+            logging.error(f"Failed to update race table for channel {channel_key}: {e!r}")
+        finally:
+            # If flush failed before the timer entry was removed, make room for the next window
+            if self._timers.get(channel_key) is asyncio.current_task():
+                del self._timers[channel_key]
+                self._deadlines.pop(channel_key, None)
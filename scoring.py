@@ -0,0 +1,100 @@
+import numpy as np
+
+# Codes stored in the result matrix next to finishing positions (which are >= 0)
+DNS = -1       # did not start
+PENALTY = -2   # DSQ or DNF
+UNSCORED = -3  # any other status, scores nothing
+
+
+def _code(result) -> int:
+    if isinstance(result, int):
+        return result
+    if result in ('DSQ', 'DNF'):
+        return PENALTY
+    return UNSCORED
+
+
+class ScoringEngine:
+    """
+    Low point scores of a regatta, kept up to date race by race.
+
+    Results live in a participants x races integer matrix. Each race column is
+    scored on its own (finishing position, or number of finishers + 1 for DSQ
+    and DNF), so adding or replacing a race only rescores that column. DNS
+    depends on the number of participants across all races, so it is counted
+    per participant and applied when the totals are read.
+    """
+
+    def __init__(self):
+        self._participants = {}  # {name: row}
+        self._races = {}  # {race: column}
+        self._codes = np.full((0, 0), DNS, dtype=np.int64)
+        self._points = np.zeros((0, 0), dtype=np.int64)
+        self._base_total = np.zeros(0, dtype=np.int64)
+        self._dns_count = np.zeros(0, dtype=np.int64)
+
+    @classmethod
+    def from_races(cls, all_races: dict) -> 'ScoringEngine':
+        engine = cls()
+        for race, results in all_races.items():
+            engine.set_race(race, results)
+        return engine
+
+    def _grow(self, participants: int, races: int):
+        rows, cols = self._codes.shape
+        if participants <= rows and races <= cols:
+            return
+        # Double the capacity so that repeated growth stays cheap
+        new_rows = rows if participants <= rows else max(participants, 2 * rows)
+        new_cols = cols if races <= cols else max(races, 2 * cols)
+        codes = np.full((new_rows, new_cols), DNS, dtype=np.int64)
+        codes[:rows, :cols] = self._codes
+        points = np.zeros((new_rows, new_cols), dtype=np.int64)
+        points[:rows, :cols] = self._points
+        self._codes, self._points = codes, points
+        self._base_total = np.concatenate((self._base_total, np.zeros(new_rows - rows, dtype=np.int64)))
+        self._dns_count = np.concatenate((self._dns_count, np.zeros(new_rows - rows, dtype=np.int64)))
+
+    def set_race(self, race, results: dict):
+        """
+        Add or replace a race. `results` maps participant names to a position
+        or a status string ('DSQ', 'DNF').
+        """
+        for name in results:
+            if name not in self._participants:
+                row = len(self._participants)
+                self._grow(row + 1, len(self._races))
+                self._participants[name] = row
+                # A newcomer did not start any of the earlier races
+                self._dns_count[row] = len(self._races)
+        if race not in self._races:
+            col = len(self._races)
+            self._grow(len(self._participants), col + 1)
+            self._races[race] = col
+            self._dns_count[:len(self._participants)] += 1
+        col = self._races[race]
+        n = len(self._participants)
+
+        codes = np.full(n, DNS, dtype=np.int64)
+        rows = np.fromiter((self._participants[name] for name in results), dtype=np.int64, count=len(results))
+        codes[rows] = np.fromiter((_code(r) for r in results.values()), dtype=np.int64, count=len(results))
+
+        finishers = int(np.count_nonzero(codes >= 0))
+        points = np.where(codes >= 0, codes, 0) + np.where(codes == PENALTY, finishers + 1, 0)
+
+        old_codes = self._codes[:n, col]
+        self._dns_count[:n] += (codes == DNS).astype(np.int64) - (old_codes == DNS)
+        self._base_total[:n] += points - self._points[:n, col]
+        self._codes[:n, col] = codes
+        self._points[:n, col] = points
+
+    def totals(self) -> dict:
+        """
+        Total score of every participant of at least one race.
+        """
+        n = len(self._participants)
+        dns_count = self._dns_count[:n]
+        active = dns_count < len(self._races)
+        dns = int(np.count_nonzero(active)) + 1
+        totals = self._base_total[:n] + dns_count * dns
+        return {name: int(totals[row]) for name, row in self._participants.items() if active[row]}
@@ -0,0 +1,250 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from languages import LanguageProfile
+from names import NameIndex
+from scoring import ScoringEngine
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS races (
+    guild_id INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    race INTEGER NOT NULL,
+    results TEXT NOT NULL,
+    PRIMARY KEY (guild_id, channel_id, race)
+);
+CREATE TABLE IF NOT EXISTS aliases (
+    guild_id INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    raw_name TEXT NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (guild_id, channel_id, raw_name)
+);
+CREATE TABLE IF NOT EXISTS table_messages (
+    guild_id INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    PRIMARY KEY (guild_id, channel_id)
+);
+"""
+
+
+class ChannelState:
+    """
+    The regatta of one channel: stored races, the scoring engine, name index
+    and OCR language profile derived from them, and the ID of the last posted
+    table message.
+    """
+
+    def __init__(self, channel_key, races: dict | None = None, aliases: dict | None = None,
+                 table_message_id: int | None = None):
+        self.channel_key = channel_key  # (guild_id, channel_id)
+        self.races = races or {}  # {race_number: {name: rank}}
+        self.table_message_id = table_message_id
+        self.scoring = ScoringEngine.from_races(self.races)
+        self.names = NameIndex(aliases=aliases)
+        # Grows with every OCRed screenshot of the channel; not persisted, the stored names restart it
+        self.languages = LanguageProfile()
+        for race in self.races.values():
+            self.names.add(race.keys())
+            self.languages.observe(race.keys())
+        self.race_table = None  # last built race table DataFrame
+        self.last_used = time.monotonic()
+
+
+class RegattaStore:
+    """
+    Per-channel regatta state, persisted in SQLite (WAL mode).
+
+    Channels are loaded the first time they are touched and evicted from
+    memory after `idle_ttl` seconds without use, so startup does not depend on
+    how many channels the bot has ever seen. Changes are applied in memory at
+    once and written behind in batches every `flush_interval` seconds by a
+    single database thread, so the event loop never waits on the disk. Reads
+    go through the same thread after any queued writes, so they always see
+    the latest state.
+    """
+
+    def __init__(self, path: str, idle_ttl: float, flush_interval: float = 1.0):
+        self.path = path
+        self.idle_ttl = idle_ttl
+        self.flush_interval = flush_interval
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="regatta-store")
+        self._conn = None  # only used from the database thread
+        self._channels = {}  # {channel_key: ChannelState}
+        self._loading = {}  # {channel_key: asyncio.Task}
+        self._writes = []  # [(sql, params)]
+        self._flush_handle = None
+
+    # --- Database thread ---
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def _write_batch(self, batch: list):
+        try:
+            conn = self._connect()
+            with conn:
+                for sql, params in batch:
+                    conn.execute(sql, params)
+        except sqlite3.Error as e:
+            logging.error(f"Failed to write {len(batch)} regatta state changes: {e}")
+
+    def _read_channel(self, channel_key):
+        conn = self._connect()
+        races = {}
+        for race, results in conn.execute(
+                "SELECT race, results FROM races WHERE guild_id = ? AND channel_id = ? ORDER BY race", channel_key):
+            races[race] = {name: rank for name, rank in json.loads(results)}
+        aliases = dict(conn.execute(
+            "SELECT raw_name, name FROM aliases WHERE guild_id = ? AND channel_id = ?", channel_key).fetchall())
+        row = conn.execute(
+            "SELECT message_id FROM table_messages WHERE guild_id = ? AND channel_id = ?", channel_key).fetchone()
+        return races, aliases, row[0] if row else None
+
+    def _count_races(self, channel_key) -> int:
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM races WHERE guild_id = ? AND channel_id = ?", channel_key).fetchone()[0]
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    # --- Write-behind queue ---
+
+    def _queue(self, sql: str, params: tuple):
+        self._writes.append((sql, params))
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.flush_interval, self._submit_writes)
+
+    def _submit_writes(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._writes:
+            return None
+        batch, self._writes = self._writes, []
+        return asyncio.get_running_loop().run_in_executor(self._executor, self._write_batch, batch)
+
+    async def flush(self):
+        """Write all queued changes now."""
+        future = self._submit_writes()
+        if future is not None:
+            await future
+
+    async def close(self):
+        await self.flush()
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._close)
+        self._executor.shutdown(wait=True)
+
+    # --- Channel state ---
+
+    async def channel(self, channel_key) -> ChannelState:
+        """Return the state of a channel, loading it from the database if needed."""
+        state = self._channels.get(channel_key)
+        if state is None:
+            task = self._loading.get(channel_key)
+            if task is None:
+                task = asyncio.ensure_future(self._load(channel_key))
+                self._loading[channel_key] = task
+            try:
+                loaded = await asyncio.shield(task)
+            finally:
+                if self._loading.get(channel_key) is task and task.done():
+                    del self._loading[channel_key]
+            state = self._channels.setdefault(channel_key, loaded)
+        state.last_used = time.monotonic()
+        return state
+
+    async def _load(self, channel_key) -> ChannelState:
+        # Queued writes of this channel must reach the database before we read it back
+        self._submit_writes()
+        loop = asyncio.get_running_loop()
+        races, aliases, table_message_id = await loop.run_in_executor(self._executor, self._read_channel, channel_key)
+        logging.info(f"Loaded {len(races)} races for channel {channel_key}")
+        return ChannelState(channel_key, races, aliases, table_message_id)
+
+    async def has_races(self, channel_key) -> bool:
+        """Whether a channel has races, without loading it into memory if it is not."""
+        state = self._channels.get(channel_key)
+        if state is not None:
+            return bool(state.races)
+        self._submit_writes()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._count_races, channel_key) > 0
+
+    def loaded_channels(self) -> int:
+        return len(self._channels)
+
+    def evict_idle(self, now: float | None = None) -> int:
+        """Drop channels unused for idle_ttl seconds from memory. Returns how many were dropped."""
+        cutoff = (time.monotonic() if now is None else now) - self.idle_ttl
+        idle = [key for key, state in self._channels.items() if state.last_used < cutoff]
+        for key in idle:
+            del self._channels[key]
+        if idle:
+            logging.info(f"Evicted {len(idle)} idle channels from memory")
+        return len(idle)
+
+    async def run_eviction(self):
+        """Background task evicting idle channels periodically."""
+        while True:
+            await asyncio.sleep(max(1.0, self.idle_ttl / 4))
+            self.evict_idle()
+
+    # --- Changes ---
+
+    def _touch(self, state: ChannelState):
+        # Keep a state that is being changed in memory, even if it was evicted meanwhile
+        self._channels.setdefault(state.channel_key, state)
+        state.last_used = time.monotonic()
+
+    def set_race(self, state: ChannelState, race_number, results: dict):
+        self._touch(state)
+        replaced = state.races.get(race_number)
+        if replaced is not None:
+            state.names.remove(replaced.keys())
+        state.races[race_number] = results
+        state.scoring.set_race(race_number, results)
+        state.names.add(results.keys())
+        self._queue("INSERT OR REPLACE INTO races (guild_id, channel_id, race, results) VALUES (?, ?, ?, ?)",
+                    (*state.channel_key, race_number, json.dumps(list(results.items()), ensure_ascii=False)))
+
+    def add_alias(self, state: ChannelState, raw_name: str, name: str):
+        self._touch(state)
+        state.names.learn(raw_name, name)
+        self._queue("INSERT OR REPLACE INTO aliases (guild_id, channel_id, raw_name, name) VALUES (?, ?, ?, ?)",
+                    (*state.channel_key, raw_name, name))
+
+    def set_table_message(self, state: ChannelState, message_id: int | None):
+        self._touch(state)
+        state.table_message_id = message_id
+        if message_id is None:
+            self._queue("DELETE FROM table_messages WHERE guild_id = ? AND channel_id = ?", state.channel_key)
+        else:
+            self._queue("INSERT OR REPLACE INTO table_messages (guild_id, channel_id, message_id) VALUES (?, ?, ?)",
+                        (*state.channel_key, message_id))
+
+    def reset(self, state: ChannelState):
+        """Start a new regatta in the channel. Learned name aliases are kept."""
+        self._touch(state)
+        state.races = {}
+        state.scoring = ScoringEngine()
+        state.names.clear()
+        state.race_table = None
+        self._queue("DELETE FROM races WHERE guild_id = ? AND channel_id = ?", state.channel_key)
+        self.set_table_message(state, None)
@@ -14,6 +14,26 @@ def test_parse_ranking():
     }
 
 
+def test_parse_rows():
+    from extract import format_rankings, parse_rankings_from_text
+    from parsing import RankingRow, by_name, parse_ocr_texts, parse_reply
+    text = """RESULTS
+| 1. FR Guest_1723161531080 +00:15.2 29 pts
+2. Solo +00:16.0 28 pts
+3. RU Cool Guy 3 +00:17.1 -1 pts
+x 0.9 ~~
+DSQ - Моряк_1
+DNF – 水手2"""
+    rows, = parse_ocr_texts([text])
+    assert rows == [RankingRow(1, "Guest_1723161531080"), RankingRow(2, "Solo"), RankingRow(3, "Cool Guy 3"),
+                    RankingRow(None, "Моряк_1", "DSQ"), RankingRow(None, "水手2", "DNF")]
+    rankings = parse_rankings_from_text(text)
+    assert rankings == {1: "Guest_1723161531080", 2: "Solo", 3: "Cool Guy 3", "DSQ": "Моряк_1", "DNF": "水手2"}
+    # The reply written from OCR results parses back to the same race
+    reply = "Ranking:\n" + "\n".join(format_rankings(rankings)) + "\nDNS Absent"
+    assert parse_ranking(reply) == {"Guest_1723161531080": 1, "Solo": 2, "Cool Guy 3": 3, "水手2": "DNF", "Моряк_1": "DSQ"}
+    assert parse_reply("DNS Absent")[0].result == "DNS" and by_name(parse_reply("DNS Absent")) == {}
+
 def test_calculate_total():
     all_races = {
         1 : {'A':1, 'B':2, 'C':3, 'D':4, 'K': 'DSQ'},
@@ -57,3 +77,682 @@ def test_render_table_image():
         f.write(data)
     # Assert that the image begins with the PNG signature.
     assert data.startswith(b'\x89PNG\r\n\x1a\n')
+
+def _fake_ocr(image_bytes, lang_hint=None):
+    return {int(image_bytes): image_bytes.decode()}, {"tesseract": 0.0}
+
+def test_ocr_pool_order_and_fairness():
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    import pytest
+    from ocr_cache import OcrCache
+    from ocr_pool import OcrPool, OcrQueueFull
+
+    async def run():
+        pool = OcrPool(workers=1, max_queue=2, func=_fake_ocr, executor=ThreadPoolExecutor(2), max_pending=4)
+        a1 = await pool.submit("guild A", [b"3", b"1", b"2"])
+        a2 = await pool.submit("guild A", [b"4"])
+        a3 = await pool.submit("guild A", [b"5"])
+        b1 = await pool.submit("guild B", [b"6"])
+        # The fourth waiting job is past the queue bound, and a fifth is refused
+        assert b1.position == 4 and b1.position > pool.max_queue
+        with pytest.raises(OcrQueueFull):
+            await pool.submit("guild C", [b"7"])
+        # Results keep the upload order of the images
+        assert await a1 == [{3: "3"}, {1: "1"}, {2: "2"}]
+        order = []
+        for job in asyncio.as_completed([a2, a3, b1]):
+            order.extend(await job)
+        pool.close()
+
+        # A message made only of cached images is answered without starting the workers
+        cache = OcrCache(max_bytes=1024)
+        cache.put(b"8", {8: "8"})
+        cached = OcrPool(workers=1, max_queue=2, func=_fake_ocr, cache=cache)
+        assert await (await cached.submit("guild A", [b"8"])) == [{8: "8"}]
+        assert cached._executor is None
+        return order
+
+    # Guild B is served before guild A's remaining queued jobs
+    assert asyncio.run(run()) == [{6: "6"}, {4: "4"}, {5: "5"}]
+
+def test_ocr_cache(tmp_path):
+    from ocr_cache import OcrCache
+    rankings = {1: "SomePlayer", 2: "Чемпион", "DSQ": "Cool Guy"}
+    cache = OcrCache(max_bytes=1024, directory=str(tmp_path))
+    assert cache.get(b"image") is None
+    cache.put(b"image", rankings)
+    assert cache.get(b"image") == rankings
+    assert (cache.hits, cache.misses) == (1, 1)
+    # The on-disk tier survives a restart
+    assert OcrCache(max_bytes=1024, directory=str(tmp_path)).get(b"image") == rankings
+    # The in-memory tier evicts the least recently used entries
+    small = OcrCache(max_bytes=len(str(rankings)) + 40)
+    small.put(b"a", rankings)
+    small.put(b"b", rankings)
+    assert small.get(b"a") is None
+    assert small.get(b"b") == rankings
+    # Entries are shared across language hints whose models they were read with
+    cache.put(b"shot", rankings, "eng+rus")
+    assert cache.get(b"shot", "eng") == rankings and cache.get(b"shot", "auto") == rankings
+    assert cache.get(b"shot", "eng+jpn") is None
+    cache.put(b"shot", rankings, "eng")
+    assert cache.get(b"shot", "eng") == rankings and cache.get(b"shot", "auto") is None
+
+def test_download_attachments():
+    import asyncio
+    from types import SimpleNamespace
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+    from downloads import create_session, download_attachments
+
+    async def handler(request):
+        return web.Response(body=b"x" * int(request.match_info["size"]))
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/{size}", handler)
+        async with TestServer(app) as server:
+            def attachment(size, reported=0):
+                return SimpleNamespace(filename=f"{size}.png", size=reported, url=str(server.make_url(f"/{size}")))
+            async with create_session(max_connections=4, timeout=10) as session:
+                return await download_attachments(session, [
+                    attachment(10),
+                    attachment(5000),  # too large, stopped while streaming
+                    attachment(20, reported=5000),  # too large according to Discord
+                    attachment(30),
+                ], max_bytes=100)
+
+    assert asyncio.run(run()) == [b"x" * 10, b"x" * 30]
+
+def _synthetic_screenshot(size=(1600, 900), font_size=48, rows=8, first_rank=1, dy=0, lines=None):
+    """
+    Ranks first_rank..first_rank + rows - 1, shifted down by dy pixels as if
+    scrolled, or the given `lines` of text in their place.
+    """
+    import numpy as np
+    from PIL import Image, ImageDraw, ImageFont
+    img = Image.new("L", size, 40)
+    # Busy "3D view" to the left of the results table, different for each scroll position
+    noise = (np.random.default_rng(first_rank - 1).random((size[1] // 3, size[0] // 3)) * 255).astype(np.uint8)
+    img.paste(Image.fromarray(noise), (50, 50))
+    draw = ImageDraw.Draw(img)
+    font = ImageFont.load_default(size=font_size)
+    left, top = size[0] * 9 // 16, size[1] // 5 + dy
+    if lines is None:
+        lines = [f"{i + 1}. Player_{i % 10} +00:1{i % 10}.2" for i in range(first_rank - 1, first_rank - 1 + rows)]
+    for i, line in enumerate(lines):
+        draw.text((left, top + i * font_size * 3 // 2), line, fill=230, font=font)
+    return img
+
+def test_find_ranking_region():
+    import io
+    import numpy as np
+    from extract import find_ranking_region, preprocess_image_from_bytes
+    img = _synthetic_screenshot()
+    (left, top, right, bottom), line_height = find_ranking_region(np.asarray(img))
+    # The crop holds the whole table and none of the 3D view
+    assert 600 < left <= 900 and top <= 180 and 1300 < right and 730 < bottom < 800
+    assert 30 <= line_height <= 40
+
+    buf = io.BytesIO()
+    _synthetic_screenshot(size=(3200, 1800), font_size=96).save(buf, format="PNG")
+    processed = preprocess_image_from_bytes(buf.getvalue())
+    # Cropped and scaled to TARGET_LINE_HEIGHT: a small fraction of the original pixels
+    assert processed.mode == "1"
+    assert processed.width * processed.height < 3200 * 1800 / 10
+
+def test_decode_screenshot(monkeypatch):
+    import io
+    import struct
+    import zlib
+    import numpy as np
+    import pytest
+    import config
+    from extract import ImageTooLarge, decode_screenshot, find_ranking_region, locate_ranking_region
+    from main import screenshot_accepted
+    img = _synthetic_screenshot(size=(3840, 2160), font_size=96)
+    png, jpeg = io.BytesIO(), io.BytesIO()
+    img.save(png, format="PNG")
+    img.convert("RGB").save(jpeg, format="JPEG")
+    # JPEGs are decoded at half scale, PNGs whole with the table located coarse to fine
+    assert decode_screenshot(jpeg.getvalue()).size == (1920, 1080)
+    full = decode_screenshot(png.getvalue())
+    assert full.size == (3840, 2160)
+    assert locate_ranking_region(full) == find_ranking_region(np.asarray(full))
+
+    monkeypatch.setattr(config, "OCR_MAX_PIXELS", 3840 * 2160 - 1)
+    with pytest.raises(ImageTooLarge):
+        decode_screenshot(png.getvalue())
+
+    # A few bytes of PNG header claiming 20000x20000, beyond Pillow's decompression bomb limit
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    bomb = (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", 20000, 20000, 8, 0, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(b"")) + chunk(b"IEND", b""))
+    with pytest.raises(ImageTooLarge):
+        decode_screenshot(bomb)
+    assert not screenshot_accepted(bomb, 1)
+
+def test_command_line_crops(tmp_path, monkeypatch):
+    from PIL import Image
+    import extract
+    seen = []
+
+    class RecordingBackend:
+        def image_to_text(self, image, lang='eng'):
+            seen.append((image.mode, image.size))
+            return "1. Player_0 +00:10.2"
+
+    monkeypatch.setattr(extract, "_backend", RecordingBackend())
+    path = str(tmp_path / "shot.png")
+    _synthetic_screenshot().save(path)
+    assert extract.extract_rankings([path]) == ["1 Player_0"]
+    assert extract.extract_rankings_from_image(Image.open(path)) == {1: "Player_0"}
+    # Both paths OCR the binarized results table, not the whole screenshot
+    assert all(mode == "1" and width < 1600 / 2 for mode, (width, _) in seen) and len(seen) == 2
+
+def test_backend_selection(monkeypatch):
+    import config
+    import extract
+    monkeypatch.setattr(config, "OCR_BACKEND", "pytesseract")
+    monkeypatch.setattr(extract, "_backend", None)
+    assert isinstance(extract.get_backend(), extract.PytesseractBackend)
+    assert "backend=pytesseract" in extract.ocr_settings_key()
+
+def test_language_selection():
+    import numpy as np
+    from PIL import ImageDraw
+    from extract import char_whitelist, cjk_score
+    from languages import AUTO, EXPLORE_EVERY, LanguageProfile, resolve
+    profile = LanguageProfile(["Player"])
+    assert profile.hint() == AUTO
+    profile.observe(["Guest_172316153", "Moryak", "Чемпион", "SailorJohn", "Windward"])
+    assert profile.hint() == "eng+rus"
+    assert [profile.next_hint() for _ in range(EXPLORE_EVERY)][-2:] == ["eng+rus", AUTO]
+    assert resolve(AUTO, 0.0) == "eng+rus" and resolve(AUTO, 0.5) == "eng+rus+jpn"
+    assert resolve("eng", 0.0) == "eng" and resolve("eng", 0.5) == "eng+jpn" and resolve("eng", 0.05) == "eng+rus+jpn"
+    assert "Ж" in char_whitelist("eng+rus") and "Ж" not in char_whitelist("eng") and char_whitelist("eng+jpn") is None
+
+    # Latin text has no CJK-like glyphs; boxes crossed by five strokes are
+    img = _synthetic_screenshot()
+    gray = np.asarray(img)
+    assert cjk_score(gray[150:800, 850:1600]) == 0
+    draw = ImageDraw.Draw(img)
+    for i in range(8):
+        for k in range(3):
+            x, y = 1450 + k * 44, 190 + i * 72
+            for f in range(0, 41, 10):
+                draw.line((x, y + f, x + 38, y + f), fill=230, width=3)
+            draw.line((x + 19, y, x + 19, y + 40), fill=230, width=3)
+    assert cjk_score(np.asarray(img)[150:800, 850:1600]) == 1
+
+def test_ocr_backends_agree():
+    import io
+    import shutil
+    import pytest
+    pytest.importorskip("tesserocr")
+    if shutil.which("tesseract") is None:
+        pytest.skip("tesseract is not installed")
+    from extract import PytesseractBackend, TesserocrBackend, parse_rankings_from_text, preprocess_image_from_bytes
+    buf = io.BytesIO()
+    _synthetic_screenshot().save(buf, format="PNG")
+    image = preprocess_image_from_bytes(buf.getvalue())
+    engine = TesserocrBackend()
+    persistent = [parse_rankings_from_text(engine.image_to_text(image)) for _ in range(2)]
+    subprocess = parse_rankings_from_text(PytesseractBackend().image_to_text(image))
+    assert persistent[0] == persistent[1] == subprocess
+    assert subprocess[1] == "Player_0"
+
+def _reference_total(all_races):
+    # The original nested-loop implementation of calculate_total
+    all_participants = set()
+    for race in all_races.values():
+        all_participants.update(race.keys())
+    dns = len(all_participants) + 1
+    totals = {}
+    for participant in all_participants:
+        total = 0
+        for race in all_races.values():
+            dsq = len([v for v in race.values() if isinstance(v, int)]) + 1
+            result = race.get(participant, dns)
+            if isinstance(result, int):
+                total += result
+            elif isinstance(result, str) and result in ('DSQ', 'DNF'):
+                total += dsq
+        totals[participant] = total
+    return totals
+
+def test_scoring_engine_incremental():
+    import random
+    from scoring import ScoringEngine
+    rng = random.Random(42)
+    names = [f"Guest_{i}" for i in range(60)]
+    engine = ScoringEngine()
+    all_races = {}
+    for step in range(40):
+        race = rng.randint(1, 10)  # some steps replace an existing race
+        starters = rng.sample(names, rng.randint(1, len(names)))
+        results = {name: pos for pos, name in enumerate(starters, start=1)}
+        for name in rng.sample(starters, len(starters) // 10):
+            results[name] = rng.choice(["DSQ", "DNF"])
+        all_races[race] = results
+        engine.set_race(race, results)
+        assert engine.totals() == _reference_total(all_races)
+
+def test_render_table_image_pil():
+    import io
+    import pandas as pd
+    from PIL import Image
+    from render_pil import ROW_HEIGHT, render_table_image_pil
+    df = pd.DataFrame({
+        "Name": ["Some Player", "Чемпион", "水手"],
+        "1": [2, 1, 3],
+        "2": [1, "DNS", 2],
+        "Total": [3, 5, 5],
+    })
+    data = render_table_image_pil(df).getvalue()
+    assert data.startswith(b'\x89PNG\r\n\x1a\n')
+    img = Image.open(io.BytesIO(data)).convert("RGB")
+    # Header plus three rows; the first data row is banded
+    assert img.height == 4 * ROW_HEIGHT
+    assert img.getpixel((1, ROW_HEIGHT + 1)) == (0xCC, 0xFF, 0x99)
+    assert img.getpixel((1, 2 * ROW_HEIGHT + 1)) == (255, 255, 255)
+
+def test_table_update_scheduler():
+    import asyncio
+    from scheduler import TableUpdateScheduler
+
+    async def run():
+        flushes = []
+
+        async def flush(channel_key, updates, message):
+            flushes.append((channel_key, dict(updates), message))
+
+        scheduler = TableUpdateScheduler(flush, debounce=0.05)
+        for race in range(1, 7):
+            scheduler.schedule("channel", race, {"A": race}, f"message {race}")
+            await asyncio.sleep(0.01)
+        scheduler.schedule("other", 1, {"B": 1}, "message")
+        scheduler.schedule("channel", 2, {"A": 1}, "message 2 again")
+        await asyncio.sleep(0.2)
+        # A reaction after the window triggers a new update
+        scheduler.schedule("channel", 7, {"A": 7}, "message 7")
+        await asyncio.sleep(0.2)
+        return flushes
+
+    flushes = asyncio.run(run())
+    assert [(key, sorted(updates), message) for key, updates, message in flushes] == [
+        ("other", [1], "message"),
+        ("channel", [1, 2, 3, 4, 5, 6], "message 2 again"),
+        ("channel", [7], "message 7"),
+    ]
+    assert flushes[1][1][2] == {"A": 1}
+
+def test_name_index():
+    from names import NameIndex
+    index = NameIndex(["Guest_1723161531080", "Cool Guy", "Чемпион"])
+    matches = index.match(["Guest_1723161531O8O", "Cool Guy", "C00l Guy", "Newcomer", "Чемпиoн"])
+    assert matches == {
+        "Guest_1723161531O8O": ("Guest_1723161531080", 2),
+        "Cool Guy": ("Cool Guy", 0),
+        "C00l Guy": ("Cool Guy", 2),
+        "Newcomer": ("Newcomer", None),
+        "Чемпиoн": ("Чемпион", 1),
+    }
+    # A match is learned as an alias only once it was made for a second race
+    assert not index.confirm("C00l Guy", "Cool Guy", 1)
+    assert not index.confirm("C00l Guy", "Cool Guy", 1)
+    assert index.confirm("C00l Guy", "Cool Guy", 2)
+    index.learn("C00l Guy", "Cool Guy")
+    assert not index.confirm("C00l Guy", "Cool Guy", 3)
+    # Names of a replaced race stop attracting matches once no race has them
+    index.add(["Garbage Nam3", "Cool Guy"])
+    index.remove(["Garbage Nam3", "Cool Guy"])
+    assert index.match(["Garbage Name", "Cool Guy"]) == {"Garbage Name": ("Garbage Name", None),
+                                                         "Cool Guy": ("Cool Guy", 0)}
+    index.clear()
+    # Learned aliases survive a reset of the regatta
+    assert index.match(["C00l Guy", "Cool Guy"]) == {"C00l Guy": ("Cool Guy", 2), "Cool Guy": ("Cool Guy", None)}
+
+def test_regatta_store(tmp_path):
+    import asyncio
+    from store import RegattaStore
+    path = str(tmp_path / "state.sqlite3")
+    channel = (1, 2)
+
+    async def write():
+        store = RegattaStore(path, idle_ttl=60, flush_interval=10)
+        state = await store.channel(channel)
+        assert state.races == {}
+        store.set_race(state, 1, {"A": 1, "B": 2, "K": "DSQ"})
+        store.set_race(state, 2, {"B": 1, "A": 2})
+        store.add_alias(state, "C00l Guy", "Cool Guy")
+        store.set_table_message(state, 1234)
+        # Evicted channels are reloaded with the changes not yet written
+        assert store.evict_idle(now=state.last_used + 61) == 1
+        assert (await store.channel(channel)).races[1] == {"A": 1, "B": 2, "K": "DSQ"}
+        # A replaced race takes its names out of the name index
+        other = await store.channel((1, 9))
+        store.set_race(other, 1, {"Typo": 1, "A": 2})
+        store.set_race(other, 1, {"A": 1})
+        assert other.names.names == ["A"]
+        await store.close()
+
+    async def read():
+        store = RegattaStore(path, idle_ttl=60)
+        # Startup recovery asks without loading the channels
+        assert await store.has_races(channel) and not await store.has_races((1, 3))
+        assert store.loaded_channels() == 0
+        state = await store.channel(channel)
+        await store.close()
+        return state
+
+    asyncio.run(write())
+    state = asyncio.run(read())
+    assert state.races == {1: {"A": 1, "B": 2, "K": "DSQ"}, 2: {"B": 1, "A": 2}}
+    assert state.scoring.totals() == calculate_total(state.races)
+    assert state.names.aliases == {"C00l Guy": "Cool Guy"}
+    assert state.table_message_id == 1234
+
+def _fake_ocr_file(path):
+    import os
+    name = os.path.splitext(os.path.basename(path))[0]
+    return path, {int(name): f"Player_{name}"}, 0.01, None
+
+def test_batch_resume(tmp_path, monkeypatch, capsys):
+    import json
+    import batch
+    from concurrent.futures import ThreadPoolExecutor
+    for race in ("race1", "race2"):
+        (tmp_path / race).mkdir()
+        for i in (1, 2):
+            (tmp_path / race / f"{i}.png").write_bytes(b"")
+    monkeypatch.setattr(batch, "ocr_file", _fake_ocr_file)
+    monkeypatch.setattr(batch, "ProcessPoolExecutor", ThreadPoolExecutor)
+    output = tmp_path / "out.jsonl"
+
+    assert batch.main([str(tmp_path / "race1"), "-o", str(output)]) == 0
+    records = [json.loads(line) for line in output.read_text().splitlines()]
+    assert sorted(r["file"] for r in records) == [str(tmp_path / "race1" / f) for f in ("1.png", "2.png")]
+    # Files already in the output are skipped on the next run
+    assert batch.main([str(tmp_path / "*" / "*.png"), "-o", str(output)]) == 0
+    assert "4 images found, 2 already done, 2 to OCR" in capsys.readouterr().err
+    assert len(output.read_text().splitlines()) == 4
+
+    grouped = tmp_path / "grouped.jsonl"
+    assert batch.main([str(tmp_path), "--group-by-dir", "-o", str(grouped)]) == 0
+    records = [json.loads(line) for line in grouped.read_text().splitlines()]
+    assert sorted(r["group"] for r in records) == [str(tmp_path / "race1"), str(tmp_path / "race2")]
+    assert records[0]["ranking"] == ["1 Player_1", "2 Player_2"]
+
+def test_metrics(monkeypatch):
+    import pytest
+    import metrics
+    monkeypatch.setattr(metrics, "_histograms", {})
+    monkeypatch.setattr(metrics, "_counters", {})
+    monkeypatch.setattr(metrics, "_gauges", {})
+    monkeypatch.setattr(metrics, "enabled", False)
+    with metrics.timed("render", 1):
+        pass
+    assert metrics._histograms == {}
+
+    metrics.enable()
+    metrics.observe("tesseract", 0.3, guild=1)
+    metrics.observe("tesseract", 2.0, guild=1)
+    with pytest.raises(ValueError):
+        with metrics.timed("render", 1):
+            raise ValueError
+    metrics.inc("ocr_cache_hit")
+    metrics.register_gauge("vri_ocr_queue_depth", "OCR jobs waiting.", lambda: 3)
+    text = metrics.render_prometheus()
+    assert 'vri_stage_seconds_bucket{stage="tesseract",guild="1",outcome="ok",le="0.25"} 0' in text
+    assert 'vri_stage_seconds_bucket{stage="tesseract",guild="1",outcome="ok",le="0.5"} 1' in text
+    assert 'vri_stage_seconds_count{stage="tesseract",guild="1",outcome="ok"} 2' in text
+    assert 'vri_stage_seconds_count{stage="render",guild="1",outcome="error"} 1' in text
+    assert 'vri_events_total{event="ocr_cache_hit",guild=""} 1' in text
+    assert "vri_ocr_queue_depth 3" in text
+    assert "tesseract: n=2 mean=1150.0ms max=2000.0ms errors=0" in metrics.summary()
+
+def test_lazy_imports():
+    import subprocess
+    import sys
+    # Importing the bot module must not pull in Discord, pandas or matplotlib
+    code = "import sys, main; print(sorted(m for m in ('discord', 'pandas', 'matplotlib', 'aiohttp') if m in sys.modules))"
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    assert out.strip() == "[]"
+
+class _FakeDiscord:
+    """Stand-in for the Discord API behind TablePublisher: keeps messages and logs calls."""
+
+    def __init__(self):
+        import asyncio
+        self.messages = {}
+        self.calls = []
+        self.rate_limit_next = 0
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    async def _call(self, *call):
+        from publish import RateLimited
+        await self.gate.wait()
+        self.calls.append(call)
+        if self.rate_limit_next:
+            self.rate_limit_next -= 1
+            raise RateLimited(0.01)
+
+    async def edit(self, channel, message_id, image):
+        from publish import MessageGone
+        await self._call("edit", message_id, image)
+        if message_id not in self.messages:
+            raise MessageGone(message_id)
+        self.messages[message_id] = image
+
+    async def post(self, reply_to, image):
+        await self._call("post", image)
+        message_id = 100 + len(self.calls)
+        self.messages[message_id] = image
+        return message_id
+
+    async def delete(self, channel, message_id):
+        await self._call("delete", message_id)
+        self.messages.pop(message_id)
+
+def test_table_publisher():
+    import asyncio
+    from types import SimpleNamespace
+    from publish import TablePublisher
+
+    async def scenario():
+        fake = _FakeDiscord()
+        stored = {}
+
+        async def on_published(channel_key, message_id):
+            stored[channel_key] = message_id
+
+        publisher = TablePublisher(fake, on_published)
+        reply_to = SimpleNamespace(channel="channel")
+        key = (1, 2)
+        # v1 is in flight while v2 and v3 arrive: v2 is superseded and never sent
+        fake.gate.clear()
+        publisher.publish(key, b"v1", reply_to)
+        await asyncio.sleep(0)
+        publisher.publish(key, b"v2", reply_to)
+        publisher.publish(key, b"v3", reply_to)
+        fake.gate.set()
+        await publisher.join()
+        first_id = stored[key]
+        assert fake.calls == [("post", b"v1"), ("edit", first_id, b"v3")]
+        assert fake.messages == {first_id: b"v3"}
+
+        # A 429 delays the edit, which is then retried
+        fake.calls.clear()
+        fake.rate_limit_next = 1
+        publisher.publish(key, b"v4", reply_to)
+        await publisher.join()
+        assert fake.calls == [("edit", first_id, b"v4"), ("edit", first_id, b"v4")]
+
+        # The table message was deleted by someone: a new one is posted
+        del fake.messages[first_id]
+        fake.calls.clear()
+        publisher.publish(key, b"v5", reply_to)
+        await publisher.join()
+        assert fake.calls[0] == ("edit", first_id, b"v5") and fake.calls[1] == ("post", b"v5")
+        assert fake.messages == {stored[key]: b"v5"}
+
+        # After a reset the next table is posted as a new message
+        publisher.discard(key)
+        fake.calls.clear()
+        publisher.publish(key, b"v6", reply_to)
+        await publisher.join()
+        assert fake.calls == [("post", b"v6")]
+
+    asyncio.run(scenario())
+
+def test_recovery():
+    import asyncio
+    from types import SimpleNamespace
+    from recovery import recover_channels, scan_history
+
+    bot, user = SimpleNamespace(id=1, bot=True), SimpleNamespace(id=2, bot=False)
+
+    def msg(id, author, content="", emojis=(), files=()):
+        return SimpleNamespace(id=id, author=author, content=content,
+                               reactions=[SimpleNamespace(emoji=e) for e in emojis],
+                               attachments=[SimpleNamespace(filename=f) for f in files])
+
+    class Channel:
+        def __init__(self, messages):
+            self.messages = messages  # oldest first
+
+        async def history(self, limit=None):
+            for message in reversed(self.messages[-limit:] if limit else self.messages):
+                yield message
+
+    channel = Channel([
+        msg(1, bot, "Ranking:\n1 Old", ["1️⃣"]),
+        msg(2, user, "!reset"),
+        msg(3, bot, "Ranking:\n1 A\n2 B", ["1️⃣"]),
+        msg(4, bot, "Ranking:\n1 B\n2 A", ["2️⃣", "👍"]),
+        msg(5, bot, "Ranking:\n1 Unlabelled"),
+        msg(8, user, "Ranking:\n1 Faker", ["2️⃣"]),
+        msg(6, bot, files=["race_table.png"]),
+        msg(7, bot, "Ranking:\n1 C\n2 A", ["1️⃣"]),
+    ])
+    found = asyncio.run(scan_history(channel, 1, {"1️⃣": 1, "2️⃣": 2}, parse_ranking, limit=None))
+    # Race 1 was labelled again later: the newer ranking wins and is applied last
+    assert found.races == {2: {"B": 1, "A": 2}, 1: {"C": 1, "A": 2}}
+    assert list(found.races) == [2, 1]
+    assert found.message.id == 7
+    assert found.table_message_id == 6
+    assert found.scanned == 7
+
+    running, peak = 0, 0
+
+    async def recover_one(channel):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        if channel == "broken":
+            raise RuntimeError
+        return 2
+
+    assert asyncio.run(recover_channels(["a", "b", "broken", "c", "d"], recover_one, concurrency=2)) == 8
+    assert peak == 2
+
+def test_row_dedupe():
+    import io
+    from rows import extract_rankings_from_rows, new_rows, segment_rows_from_bytes, stack_rows
+    def png(img):
+        buf = io.BytesIO()
+        img.save(buf, format="PNG")
+        return buf.getvalue()
+
+    # Ranks 1-8, 5-12 (scrolled by a fraction of a row) and 9-16
+    shots = [png(_synthetic_screenshot(first_rank=first_rank, dy=dy)) for first_rank, dy in ((1, 0), (5, 13), (9, 0))]
+    strips = [segment_rows_from_bytes(shot)[0] for shot in shots]
+    assert [len(s) for s in strips] == [8, 8, 8]
+    # Only the rows not in an earlier screenshot are left, although rows 5 and 6 look alike
+    unique = new_rows(strips)
+    assert [len(s) for s in unique] == [8, 4, 4]
+    assert unique[1][0] is strips[1][4]
+    stacked = stack_rows(unique[1])
+    assert stacked.height == sum(s.size[1] for s in unique[1])
+    assert extract_rankings_from_rows([]) == ({}, {})
+
+    # Small rows differing in one digit can share a hash, but are not the same row
+    names = [f"DNF - Guest_17231615031{i}8{j}" for i in range(3) for j in range(10)]
+    strips = [segment_rows_from_bytes(png(_synthetic_screenshot(font_size=14, lines=lines)))[0]
+              for lines in (names, [name[:-2] + "9" + name[-1] for name in names])]
+    assert any(a.hash == b.hash for a in strips[0] for b in strips[1])
+    assert [len(s) for s in new_rows(strips)] == [30, 30]
+
+def test_ocr_queue(tmp_path, monkeypatch):
+    import asyncio
+    import json
+    from concurrent.futures import ThreadPoolExecutor
+    import pytest
+    import ocr_queue
+    from ocr_pool import OcrPool
+    from ocr_worker import serve_jobs
+    monkeypatch.setitem(ocr_queue.FUNCTIONS, ocr_queue._name(_fake_ocr), _fake_ocr)
+    address = f"unix:{tmp_path / 'ocr.sock'}"
+
+    # Frames are JSON: rankings keep their positions, row strips their pixels
+    from rows import RowStrip
+    strip = RowStrip(b"\x01\x02", (30, 10), b"\x80" * 300, (100, 12), b"\xff" * 1200)
+    value = ocr_queue.decode(json.dumps(ocr_queue.encode(({1: "A", "DSQ": "B"}, [strip], {"$x": None}))))
+    assert value[0] == {1: "A", "DSQ": "B"} and value[2] == {"$x": None}
+    assert (value[1][0].pixels, value[1][0].size, value[1][0].same_row(strip)) == (strip.pixels, (100, 12), True)
+    with pytest.raises(ValueError):
+        ocr_queue.OcrQueue("0.0.0.0:8765")
+    # Job IDs hash the raw arguments, each behind its length
+    assert ocr_queue.job_id("f", (b"ab", "c")) != ocr_queue.job_id("f", (b"a", "bc"))
+    assert ocr_queue.job_id("f", ([strip], None)) == ocr_queue.job_id("f", ([value[1][0]], None))
+
+    async def scenario():
+        queue = ocr_queue.OcrQueue(address, token="secret", job_timeout=5)
+        await queue.start()
+        # Identical jobs share one job ID and one future
+        first = queue.submit(_fake_ocr, b"7")
+        assert queue.submit(_fake_ocr, b"7") is first and queue.pending == 1
+
+        # A worker that takes the job and disappears: the job goes to the next worker
+        reader, writer = await ocr_queue.open_connection(address)
+        await ocr_queue.write_raw_frame(writer, b"secret\nflaky")
+        assert (await ocr_queue.read_frame(reader))["args"] == (b"7",)
+        writer.close()
+
+        # A worker with a wrong token is turned away
+        reader, writer = await ocr_queue.open_connection(address)
+        await ocr_queue.write_raw_frame(writer, b"wrong\nintruder")
+        assert await reader.read() == b""
+
+        executor = ThreadPoolExecutor(2)
+        workers = [asyncio.create_task(serve_jobs(address, "secret", executor, f"worker{i}")) for i in range(2)]
+        assert await asyncio.wrap_future(first) == ({7: "7"}, {"tesseract": 0.0})
+
+        # Jobs in flight follow the connected workers, not the bot's CPU count
+        pool = OcrPool(workers=8, max_queue=4, func=_fake_ocr, executor=queue)
+        assert await (await pool.submit("guild", [b"1", b"2", b"3"])) == [{1: "1"}, {2: "2"}, {3: "3"}]
+        assert queue.workers == 2 and pool.capacity == 2
+        pool.close()
+        await asyncio.gather(*workers)
+        executor.shutdown()
+
+        # With no worker connected, a job fails once it has waited queue_timeout
+        idle = ocr_queue.OcrQueue(f"unix:{tmp_path / 'idle.sock'}", queue_timeout=0.05)
+        await idle.start()
+        idle_pool = OcrPool(workers=8, max_queue=4, executor=idle)
+        assert idle_pool.capacity == 1
+        # Remote workers warm up themselves: nothing is queued for them
+        await idle_pool.warm_up()
+        assert idle.pending == 0
+        with pytest.raises(TimeoutError):
+            await asyncio.wrap_future(idle.submit(_fake_ocr, b"1"))
+        assert idle.pending == 0
+        idle.shutdown()
+
+    asyncio.run(scenario())